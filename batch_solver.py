@@ -0,0 +1,140 @@
+'''
+
+Solve a corpus of warehouses in parallel with solve_weighted_sokoban.
+
+Each level is solved in its own worker process, under a time limit and an
+address space limit, and one JSON line is printed per level as soon as it
+is done, with the fields
+    file, status, solution, cost, nodes, generated, time, peak_rss_kb
+where status is 'solved', 'impossible', 'timeout', 'memory' or 'error'.
+Levels are started largest first so that the slowest ones do not end up
+running alone at the end of the batch.
+
+Usage:
+    python batch_solver.py [directory or glob ...] [--jobs N] [--timeout S]
+                           [--memory MB] [--mode elem|push|bitboard|bidirectional]
+
+'''
+
+import argparse
+import glob
+import json
+import os
+import signal
+import sys
+import time
+from multiprocessing import Pool
+
+import search
+from search import resource
+from sokoban import Warehouse
+from mySokobanSolver import run_strategy
+
+
+class LevelTimeout(Exception):
+    '''Raised in a worker process when its level runs out of time.'''
+
+
+def level_paths(patterns):
+    '''
+    Return the warehouse files named by patterns, each a directory (all its
+    .txt files) or a glob, without duplicates.
+    '''
+    paths = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            pattern = os.path.join(pattern, '*.txt')
+        paths.extend(sorted(glob.glob(pattern)))
+    return list(dict.fromkeys(paths))
+
+
+def level_size(path):
+    '''
+    Rough size of the search space of a level: (number of boxes, number of
+    non-wall cells between the first and last wall of each row), read from
+    the text of the level without loading it, so that a level that fails
+    to load is only reported by solve_level.
+    '''
+    boxes = cells = 0
+    with open(path) as f:
+        for line in f:
+            boxes += line.count('$') + line.count('*')
+            row = line[line.find('#'):line.rfind('#')]
+            cells += len(row) - row.count('#')
+    return (boxes, cells)
+
+
+def _raise_timeout(signum, frame):
+    raise LevelTimeout()
+
+
+def solve_level(path, mode='elem', timeout=None, memory_mb=None):
+    '''
+    Solve the level stored in path and return its JSON record as a dict.
+    The time limit (seconds) and memory limit (megabytes) apply to the
+    whole calling process, which is meant to solve a single level. The
+    memory limit is not enforced where the resource module is missing.
+    The node counts are those of the search.SearchStats of the search,
+    which are up to date even when the level runs out of time or memory.
+    '''
+    if memory_mb and resource is not None:
+        limit = memory_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    if timeout:
+        signal.signal(signal.SIGALRM, _raise_timeout)
+        signal.alarm(timeout)
+    record = {'file': os.path.basename(path), 'status': None,
+              'solution': None, 'cost': None}
+    stats = search.SearchStats()
+    start = time.perf_counter()
+    try:
+        wh = Warehouse()
+        wh.load_warehouse(path)
+        solution, cost, _ = run_strategy(wh, mode, stats=stats, time_methods=False)
+        record['status'] = 'impossible' if cost is None else 'solved'
+        record['solution'] = solution
+        record['cost'] = cost
+    except LevelTimeout:
+        record['status'] = 'timeout'
+    except MemoryError:
+        record['status'] = 'memory'
+    except Exception as e:
+        record['status'] = 'error'
+        record['error'] = f"{type(e).__name__}: {e}"
+    finally:
+        signal.alarm(0)
+    record['nodes'] = stats.expanded
+    record['generated'] = stats.generated
+    record['time'] = round(time.perf_counter() - start, 3)
+    record['peak_rss_kb'] = search.peak_rss_kb()
+    return record
+
+
+def _solve_task(task):
+    return solve_level(*task)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Solve warehouses in parallel.')
+    parser.add_argument('levels', nargs='*', default=['warehouses'],
+                        help='directories or globs of warehouse files')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count(),
+                        help='number of worker processes')
+    parser.add_argument('--timeout', type=int, default=60,
+                        help='time limit per level in seconds (0 for none)')
+    parser.add_argument('--memory', type=int, default=2048,
+                        help='memory limit per level in megabytes (0 for none)')
+    parser.add_argument('--mode', default='push',
+                        choices=['elem', 'push', 'bitboard', 'bidirectional'])
+    args = parser.parse_args(argv)
+
+    paths = sorted(level_paths(args.levels), key=level_size, reverse=True)
+    tasks = [(path, args.mode, args.timeout, args.memory) for path in paths]
+    # A fresh process per level, so that limits and peak RSS are per level
+    with Pool(args.jobs, maxtasksperchild=1) as pool:
+        for record in pool.imap_unordered(_solve_task, tasks):
+            print(json.dumps(record), flush=True)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,76 @@
+'''
+
+Benchmark of the frontier used by search.best_first_graph_search.
+
+Solves a set of warehouses with A* twice, once with the original
+search.PriorityQueue (linear membership test and deletion) and once with
+search.IndexedPriorityQueue, and prints the number of expanded nodes and the
+nodes/sec of each run.
+
+Usage:
+    python benchmark_frontier.py [warehouse files...]
+
+'''
+
+import sys
+import time
+
+import search
+from sokoban import Warehouse
+from mySokobanSolver import SokobanPuzzle
+
+
+DEFAULT_WAREHOUSES = [
+    "./warehouses/warehouse_01.txt",
+    "./warehouses/warehouse_07.txt",
+    "./warehouses/warehouse_09.txt",
+    "./warehouses/warehouse_47.txt",
+    "./warehouses/warehouse_8a.txt",
+    "./warehouses/warehouse_5n.txt",
+]
+
+
+class CountingSokobanPuzzle(SokobanPuzzle):
+    '''
+    SokobanPuzzle that counts its expansions (one call of actions per node).
+    '''
+    def __init__(self, warehouse):
+        super().__init__(warehouse)
+        self.expanded = 0
+
+    def actions(self, state):
+        self.expanded += 1
+        return super().actions(state)
+
+
+def run(warehouse, queue_class):
+    '''
+    Solve warehouse with A* using a frontier of type queue_class.
+    Return (number of expanded nodes, elapsed seconds, solution cost).
+    '''
+    problem = CountingSokobanPuzzle(warehouse)
+    h = search.memoize(problem.h, slot='h')
+    f = lambda n: n.path_cost + h(n)
+    start = time.perf_counter()
+    node = search.best_first_graph_search(problem, f, frontier=queue_class(f=f))
+    elapsed = time.perf_counter() - start
+    return problem.expanded, elapsed, node.path_cost if node else None
+
+
+def main(paths):
+    print(f"{'warehouse':<22}{'nodes':>9}{'before n/s':>13}{'after n/s':>13}{'speedup':>9}")
+    for path in paths:
+        wh = Warehouse()
+        wh.load_warehouse(path)
+        before = run(wh, search.PriorityQueue)
+        after = run(wh, search.IndexedPriorityQueue)
+        assert before[0] == after[0] and before[2] == after[2]
+        rate_before = before[0] / before[1]
+        rate_after = after[0] / after[1]
+        name = path.rsplit('/', 1)[-1]
+        print(f"{name:<22}{after[0]:>9}{rate_before:>13.0f}{rate_after:>13.0f}"
+              f"{rate_after / rate_before:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:] or DEFAULT_WAREHOUSES)
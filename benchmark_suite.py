@@ -0,0 +1,191 @@
+'''
+
+Benchmark suite with regression gating over the warehouses corpus.
+
+Solves a fixed set of warehouses with solve_weighted_sokoban, one fresh
+process per level (run one at a time so timings do not interfere), and
+records for each level the cost, wall time, nodes expanded and generated,
+nodes/sec and peak RSS. The time is the median of --repeat runs; it is
+also given relative to a calibration workload timed on the same machine
+(relative_time), so that runs on different machines can be compared.
+The report is written as JSON and compared with a stored baseline: the
+run fails (exit status 1) when a status or cost changes or when the
+nodes expanded grow by more than --node-threshold. Timings are only
+gated when --time-threshold is given, on the relative times (ignoring
+changes under --min-seconds).
+
+Usage:
+    python benchmark_suite.py [levels ...] [--mode push] [--report FILE]
+                              [--baseline FILE] [--update-baseline]
+                              [--repeat 3] [--time-threshold T]
+
+'''
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+from collections import deque
+from multiprocessing import Pool
+
+from batch_solver import level_paths, solve_level
+
+
+DEFAULT_LEVELS = [
+    "./warehouses/warehouse_01.txt",
+    "./warehouses/warehouse_03.txt",
+    "./warehouses/warehouse_09.txt",
+    "./warehouses/warehouse_47.txt",
+    "./warehouses/warehouse_5n.txt",
+    "./warehouses/warehouse_81.txt",
+    "./warehouses/warehouse_8a.txt",
+    "./warehouses/warehouse_121.txt",
+    "./warehouses/warehouse_147.txt",
+]
+
+DEFAULT_BASELINE = 'benchmark_baseline.json'
+DEFAULT_REPORT = 'benchmark_report.json'
+
+
+def calibration_workload(size=200):
+    '''
+    A fixed pure Python workload, independent of the solver: flood fill a
+    size x size grid with a set and a deque, as the solver's searches do.
+    '''
+    seen = {(0, 0)}
+    frontier = deque([(0, 0)])
+    while frontier:
+        x, y = frontier.popleft()
+        for nxt in ((x + 1, y), (x - 1, y), (x, y + 1), (x, y - 1)):
+            if 0 <= nxt[0] < size and 0 <= nxt[1] < size and nxt not in seen:
+                seen.add(nxt)
+                frontier.append(nxt)
+    return len(seen)
+
+
+def calibration_seconds(repeat=5):
+    '''Return the median time of repeat runs of calibration_workload.'''
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        calibration_workload()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def run_benchmark(paths, mode='push', timeout=300, repeat=3):
+    '''
+    Solve each level of paths repeat times, each in a fresh process, and
+    return the report, a dict mapping each file name to its measurements.
+    '''
+    calibration = calibration_seconds()
+    tasks = [(path, mode, timeout, None) for path in paths for _ in range(repeat)]
+    runs = {}
+    with Pool(1, maxtasksperchild=1) as pool:
+        for record in pool.imap(_solve_task, tasks):
+            runs.setdefault(record['file'], []).append(record)
+    return {name: measurements(records, calibration) for name, records in runs.items()}
+
+
+def _solve_task(task):
+    return solve_level(*task)
+
+
+def measurements(records, calibration):
+    '''
+    Return the benchmark measurements of repeated batch_solver records of
+    a level, given the calibration_seconds of the machine.
+    '''
+    record = records[0]
+    seconds = statistics.median(r['time'] for r in records)
+    return {
+        'status': record['status'],
+        'cost': record['cost'],
+        'time': seconds,
+        'relative_time': round(seconds / calibration, 3),
+        'nodes': record['nodes'],
+        'generated': record['generated'],
+        'nodes_per_sec': round(record['nodes'] / seconds) if seconds else None,
+        'peak_rss_kb': max(r['peak_rss_kb'] or 0 for r in records),
+    }
+
+
+def compare(report, baseline, node_threshold=0.05, time_threshold=None, min_seconds=0.1):
+    '''
+    Return the list of regressions of report with respect to baseline, as
+    human readable strings. Levels missing from either side are ignored.
+    Times are only compared if time_threshold is given, as relative times
+    (see measurements), and only when the absolute times differ by more
+    than min_seconds.
+    '''
+    regressions = []
+    for name, run in sorted(report.items()):
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if run['status'] != base['status'] or run['cost'] != base['cost']:
+            regressions.append(f"{name}: {run['status']} with cost {run['cost']}, "
+                               f"was {base['status']} with cost {base['cost']}")
+            continue
+        if run['nodes'] > base['nodes'] * (1 + node_threshold):
+            regressions.append(f"{name}: {run['nodes']} nodes expanded, was {base['nodes']}")
+        if time_threshold is None or 'relative_time' not in base:
+            continue
+        if run['relative_time'] > base['relative_time'] * (1 + time_threshold) and \
+                run['time'] - base['time'] > min_seconds:
+            regressions.append(f"{name}: relative time {run['relative_time']:.3f}, "
+                               f"was {base['relative_time']:.3f}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the solver against a baseline.')
+    parser.add_argument('levels', nargs='*', default=DEFAULT_LEVELS,
+                        help='directories or globs of warehouse files')
+    parser.add_argument('--mode', default='push',
+                        choices=['elem', 'push', 'bitboard', 'bidirectional'])
+    parser.add_argument('--timeout', type=int, default=300,
+                        help='time limit per level in seconds')
+    parser.add_argument('--report', default=DEFAULT_REPORT)
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--update-baseline', action='store_true',
+                        help='store this run as the new baseline')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='number of runs per level, the median time is kept')
+    parser.add_argument('--node-threshold', type=float, default=0.05)
+    parser.add_argument('--time-threshold', type=float, default=None,
+                        help='also fail when the relative time grows by more than this')
+    parser.add_argument('--min-seconds', type=float, default=0.1)
+    args = parser.parse_args(argv)
+
+    report = run_benchmark(level_paths(args.levels), args.mode, args.timeout, args.repeat)
+    print(f"{'warehouse':<22}{'status':>12}{'cost':>7}{'time':>9}{'relative':>10}{'nodes':>9}"
+          f"{'generated':>11}{'nodes/s':>9}{'rss kB':>9}")
+    for name, run in report.items():
+        print(f"{name:<22}{run['status']:>12}{str(run['cost']):>7}{run['time']:>9.3f}"
+              f"{run['relative_time']:>10.3f}{run['nodes']:>9}{run['generated']:>11}"
+              f"{str(run['nodes_per_sec']):>9}{run['peak_rss_kb']:>9}")
+    with open(args.report, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    if args.update_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline written to {args.baseline}")
+        return 0
+    if not os.path.exists(args.baseline):
+        print(f"No baseline {args.baseline}; run with --update-baseline to create it")
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare(report, baseline, args.node_threshold,
+                          args.time_threshold, args.min_seconds)
+    for regression in regressions:
+        print("REGRESSION", regression)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,206 @@
+'''
+
+Offline database of deadlock patterns for the Sokoban solver.
+
+A pattern is the content of a small rectangular window of the warehouse
+(width x height cells), each cell being a floor, a wall or a box. The
+builder enumerates every pattern with at most max_boxes boxes and proves
+by exhaustive search which ones are deadlocks, that is, whose boxes can
+never all be pushed out of the window. The search runs in a relaxed world
+where everything outside the window is free floor, so a deadlock there
+is a deadlock in any warehouse, as long as the window holds no target.
+
+The database file is a short header followed by a bitset with one bit per
+pattern. It is memory-mapped on first use, so loading it is instant and
+several solver processes share the same pages.
+
+Usage:
+    python deadlock_patterns.py [path] [--width 3] [--height 3] [--max-boxes 6]
+
+'''
+
+import argparse
+import mmap
+import struct
+from collections import deque
+
+
+FLOOR, WALL, BOX = 0, 1, 2
+
+MAGIC = b'SOKDLDB1'
+HEADER = struct.Struct('<8sBBB5x')  # magic, width, height, max_boxes
+
+DEFAULT_PATH = 'deadlock_patterns.db'
+
+
+def decode_pattern(code, width, height):
+    '''
+    Return the list of cell contents (row-major) of the pattern numbered code.
+    '''
+    cells = []
+    for _ in range(width * height):
+        code, content = divmod(code, 3)
+        cells.append(content)
+    return cells
+
+
+def encode_pattern(cells):
+    '''
+    Return the number of a pattern given its row-major list of cell contents.
+    '''
+    code = 0
+    for content in reversed(cells):
+        code = code * 3 + content
+    return code
+
+
+def is_deadlock_pattern(cells, width, height):
+    '''
+    Return True if the boxes of the pattern can never all be pushed out of
+    the window, whatever the worker position, when the window is surrounded
+    by free floor. Boxes leaving the window are removed, which only makes
+    the problem easier.
+    '''
+    walls = {(i % width, i // width) for i, c in enumerate(cells) if c == WALL}
+    boxes = frozenset((i % width, i // width) for i, c in enumerate(cells) if c == BOX)
+    if not boxes:
+        return False
+    world = {(x, y) for x in range(-1, width + 1) for y in range(-1, height + 1)} - walls
+
+    def inside(cell):
+        return 0 <= cell[0] < width and 0 <= cell[1] < height
+
+    def reachable_from(start, boxes):
+        region = {start}
+        frontier = deque([start])
+        while frontier:
+            x, y = frontier.popleft()
+            for dx, dy in [(-1, 0), (1, 0), (0, -1), (0, 1)]:
+                nxt = (x + dx, y + dy)
+                if nxt in world and nxt not in boxes and nxt not in region:
+                    region.add(nxt)
+                    frontier.append(nxt)
+        return region
+
+    # One search from every region the worker may start in; states visited
+    # by an exhausted search are dead, so they are shared between searches.
+    visited = set()
+    for start in sorted(world - boxes):
+        region = reachable_from(start, boxes)
+        if (min(region), boxes) in visited:
+            continue
+        visited.add((min(region), boxes))
+        frontier = deque([(region, boxes)])
+        while frontier:
+            region, boxes = frontier.popleft()
+            for bx, by in boxes:
+                for dx, dy in [(-1, 0), (1, 0), (0, -1), (0, 1)]:
+                    nxt = (bx + dx, by + dy)
+                    if (bx - dx, by - dy) not in region or nxt not in world or nxt in boxes:
+                        continue
+                    new_boxes = boxes - {(bx, by)}
+                    if inside(nxt):
+                        new_boxes |= {nxt}
+                    if not new_boxes:
+                        return False
+                    new_region = reachable_from((bx, by), new_boxes)
+                    signature = (min(new_region), new_boxes)
+                    if signature not in visited:
+                        visited.add(signature)
+                        frontier.append((new_region, new_boxes))
+    return True
+
+
+def build_pattern_database(path=DEFAULT_PATH, width=3, height=3, max_boxes=6):
+    '''
+    Enumerate all the patterns of a width x height window with at most
+    max_boxes boxes, prove which ones are deadlocks and write the database
+    to path. Return the number of deadlock patterns.
+    '''
+    n_patterns = 3 ** (width * height)
+    bits = bytearray((n_patterns + 7) // 8)
+    count = 0
+    for code in range(n_patterns):
+        cells = decode_pattern(code, width, height)
+        if cells.count(BOX) > max_boxes:
+            continue
+        if is_deadlock_pattern(cells, width, height):
+            bits[code >> 3] |= 1 << (code & 7)
+            count += 1
+    with open(path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, width, height, max_boxes))
+        f.write(bits)
+    return count
+
+
+class PatternDatabase:
+    '''
+    Read-only view of a deadlock pattern database file. The file is opened
+    and memory-mapped on the first lookup.
+    '''
+
+    def __init__(self, path=DEFAULT_PATH):
+        self.path = path
+        self.bits = None
+
+    def load(self):
+        '''Memory-map the database file and read its header.'''
+        with open(self.path, 'rb') as f:
+            self.bits = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.width, self.height, self.max_boxes = HEADER.unpack_from(self.bits)
+        if magic != MAGIC:
+            raise ValueError(f"{self.path} is not a deadlock pattern database")
+
+    def __contains__(self, code):
+        '''Return True if the pattern numbered code is a deadlock.'''
+        if self.bits is None:
+            self.load()
+        return bool(self.bits[HEADER.size + (code >> 3)] >> (code & 7) & 1)
+
+    def is_deadlock(self, box, boxes, open_cells, targets):
+        '''
+        Return True if some window containing the box at position box
+        matches a deadlock pattern. boxes is the set of box positions,
+        open_cells the cells the worker could ever walk on (anything else
+        counts as a wall) and targets the target cells. Windows holding a
+        target are skipped.
+        '''
+        if self.bits is None:
+            self.load()
+        bx, by = box
+        for oy in range(by - self.height + 1, by + 1):
+            for ox in range(bx - self.width + 1, bx + 1):
+                code = self.window_code(ox, oy, boxes, open_cells, targets)
+                if code is not None and code in self:
+                    return True
+        return False
+
+    def window_code(self, ox, oy, boxes, open_cells, targets):
+        '''
+        Return the pattern number of the window whose top left cell is
+        (ox, oy), or None if the window holds a target.
+        '''
+        cells = []
+        for y in range(oy, oy + self.height):
+            for x in range(ox, ox + self.width):
+                cell = (x, y)
+                if cell in targets:
+                    return None
+                if cell in boxes:
+                    cells.append(BOX)
+                elif cell in open_cells:
+                    cells.append(FLOOR)
+                else:
+                    cells.append(WALL)
+        return encode_pattern(cells)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Build the deadlock pattern database.')
+    parser.add_argument('path', nargs='?', default=DEFAULT_PATH)
+    parser.add_argument('--width', type=int, default=3)
+    parser.add_argument('--height', type=int, default=3)
+    parser.add_argument('--max-boxes', type=int, default=6)
+    args = parser.parse_args()
+    count = build_pattern_database(args.path, args.width, args.height, args.max_boxes)
+    print(f"{count} deadlock patterns written to {args.path}")
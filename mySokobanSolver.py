@@ -24,9 +24,34 @@ Last modified by 2021-08-17  by f.maire@qut.edu.au
 
 import search 
 import sokoban
-from collections import deque
+import hashlib
+import heapq
+import os
+import pickle
+import random
+import struct
+import time
+import logging
+import multiprocessing
+import traceback
+import queue
+from collections import deque, OrderedDict
 from itertools import combinations
 
+from deadlock_patterns import PatternDatabase
+from solution_cache import SolutionCache
+
+INF = float('inf')
+
+logger = logging.getLogger(__name__)
+
+# Boxes further than this from a pushed box are ignored by the freeze test
+FREEZE_RADIUS = 3
+
+# Between grids of 0/1 flags and the binary digits of bitmasks (see flags_to_mask)
+FLAG_DIGITS = bytes.maketrans(b'\x00\x01', b'01')
+DIGIT_FLAGS = bytes.maketrans(b'01', b'\x00\x01')
+
 # -----------------------------------------------------------------------------
 def my_team():
     '''
@@ -133,8 +158,9 @@ def get_interior_cells(warehouse):
     ''' 
     Use BFS from the worker to identify cells inside the warehouse.
     '''
-    lines = [list(line) for line in str(warehouse).split('\n')]
-    height = len(lines)
+    # The warehouse is drawn in the bounding box of its walls
+    width = 1 + max(x for x, _ in warehouse.walls)
+    height = 1 + max(y for _, y in warehouse.walls)
 
     walls = set(warehouse.walls)
     visited = set()
@@ -154,13 +180,141 @@ def get_interior_cells(warehouse):
         x, y = queue.popleft()
         for dx, dy in directions:
             nx, ny = x + dx, y + dy
-            if 0 <= ny < height and 0 <= nx < len(lines[ny]):
+            if 0 <= ny < height and 0 <= nx < width:
                 if (nx, ny) not in walls and (nx, ny) not in visited:
                     visited.add((nx, ny))
                     queue.append((nx, ny))
 
     return visited
 
+def flags_to_mask(flags):
+    '''Return the bitmask whose bit i is flags[i], for bytes of 0/1 flags.'''
+    return int(flags.translate(FLAG_DIGITS)[::-1], 2)
+
+def mask_to_flags(mask, size):
+    '''Return the bytearray of the size first bits of a bitmask as 0/1 flags.'''
+    return bytearray(format(mask, 'b').zfill(size)[::-1].encode().translate(DIGIT_FLAGS))
+
+def reverse_mask(mask, size):
+    '''Return the bitmask of size bits with the bits of mask in reverse order.'''
+    return int(format(mask, 'b').zfill(size)[::-1], 2)
+
+def transpose_flags(flags, stride):
+    '''Return the flags of a grid of rows of stride cells, column by column.'''
+    return b''.join(flags[x::stride] for x in range(stride))
+
+def get_runs_between(cells, ends, size):
+    '''
+    Return the bitmask of the runs of consecutive bits of the bitmask cells
+    that have a bit of ends just below and just above them; no bit is
+    above size. Adding the bit at the bottom of a run to cells carries
+    through the whole run, which fills it upwards; doing the same with the
+    bit order reversed fills it downwards.
+    '''
+    starts = cells & (ends << 1)
+    upwards = ((cells + starts) ^ cells) & cells
+    cells, ends = reverse_mask(cells, size), reverse_mask(ends, size)
+    starts = cells & (ends << 1)
+    downwards = reverse_mask(((cells + starts) ^ cells) & cells, size)
+    return upwards & downwards
+
+def get_taboo_grid(warehouse):
+    '''
+    Linear-time taboo analysis (see taboo_cells) on a flat grid.
+    Return (width, height, wall, taboo) where wall and taboo are bytearrays
+    of width * height flags, cell (x, y) being at index y * width + x, and
+    width and height are those of str(warehouse).
+    Sets of cells are bitmasks, Python integers with one bit per cell, so
+    that each step is a few operations on whole grids. The interior is
+    flood filled from the worker (see get_reachable_mask and fill_runs),
+    the corners are the interior cells, other than targets, with a wall
+    along their row and one along their column (Rule 1), and the runs of
+    cells along a wall between two corners are found along every row at
+    once, then along every column (Rule 2, see get_runs_between). Cells
+    between non-consecutive corners need no other work: the corners in
+    between are themselves taboo and each run between two of them has
+    been checked.
+    '''
+    width = 1 + max(x for x, _ in warehouse.walls)
+    height = 1 + max(y for _, y in warehouse.walls)
+    # Work on a grid padded with one free, never visited, cell on each side
+    # so that every neighbour of a cell has a bit and no run goes past the
+    # end of a row
+    stride = width + 2
+    size = stride * (height + 2)
+    wall = bytearray(size)
+    for x, y in warehouse.walls:
+        wall[(y + 1) * stride + x + 1] = 1
+    target = bytearray(size)
+    for x, y in warehouse.targets:
+        target[(y + 1) * stride + x + 1] = 1
+    free = bytearray(size)
+    for y in range(1, height + 1):
+        free[y * stride + 1:y * stride + width + 1] = b'\x01' * width
+    walls, targets = flags_to_mask(wall), flags_to_mask(target)
+    free = flags_to_mask(free) & ~walls
+
+    interior = 0
+    worker = (warehouse.worker[1] + 1) * stride + warehouse.worker[0] + 1
+    if not wall[worker]:
+        interior = get_reachable_mask(1 << worker, free, stride, 2 * (width + height))
+        if interior is None:
+            interior = flags_to_mask(fill_runs(mask_to_flags(free, size), worker, stride))
+
+    # Rule 1; as in the map drawn by str(warehouse), a target with the
+    # worker on it can be a corner, a target with a box on it cannot
+    along_row = (walls << stride) | (walls >> stride)  # a wall above or below
+    along_column = (walls << 1) | (walls >> 1)  # a wall on the left or right
+    corners = interior & ~(targets & ~(1 << worker)) & along_row & along_column
+
+    # Rule 2; targets end a run of cells along a wall
+    cells = interior & ~corners & ~targets
+    taboo = corners | get_runs_between(cells & along_row, corners, size)
+    column_stride = height + 2
+    column_taboo = get_runs_between(
+        flags_to_mask(transpose_flags(mask_to_flags(cells & along_column, size), stride)),
+        flags_to_mask(transpose_flags(mask_to_flags(corners, size), stride)), size)
+    taboo |= flags_to_mask(transpose_flags(mask_to_flags(column_taboo, size), column_stride))
+    taboo = mask_to_flags(taboo, size)
+
+    # Back to the unpadded grid
+    flags = [bytearray(width * height) for _ in range(2)]
+    for y in range(height):
+        row = (y + 1) * stride + 1
+        for grid, padded in zip(flags, (wall, taboo)):
+            grid[y * width:(y + 1) * width] = padded[row:row + width]
+    return width, height, flags[0], flags[1]
+
+def get_taboo_cells(warehouse):
+    '''
+    Return the set of the (x, y) taboo cells of the warehouse, the cells
+    marked 'X' by taboo_cells.
+    '''
+    width, _, _, taboo = get_taboo_grid(warehouse)
+    return {(i % width, i // width) for i, flag in enumerate(taboo) if flag}
+
+def pairwise_taboo_cells(warehouse):
+    '''
+    Former implementation of taboo_cells, quadratic in the number of
+    corners: every pair of aligned corners is checked by walking the cells
+    between them. Kept as the reference that taboo_cells is tested and
+    benchmarked against (see taboo_benchmark.py).
+    '''
+    lines = str(warehouse).split('\n')
+    wall_cells = set(warehouse.walls)
+    interior_cells = get_interior_cells(warehouse)
+
+    taboo_row_nullifier = set(warehouse.targets) | set(find_2D_iterator(lines, '*')) | set(find_2D_iterator(lines, '#'))
+    candidate_taboo_cells = set(find_2D_iterator_exclude(lines, '.', '#', '*', '?'))
+
+    candidate_taboo_cells &= interior_cells
+
+    corner_taboo_cells = get_corner_taboo_cells(candidate_taboo_cells, wall_cells)
+    wall_taboo_cells = get_wall_taboo_cells(corner_taboo_cells, taboo_row_nullifier, wall_cells)
+    taboo_cells = (corner_taboo_cells | wall_taboo_cells) & interior_cells
+
+    return get_taboo_cell_map(warehouse, taboo_cells)
+
 def taboo_cells(warehouse):
     '''  
     Identify the taboo cells of a warehouse. A "taboo cell" is by definition
@@ -185,39 +339,679 @@ def taboo_cells(warehouse):
        The returned string should NOT have marks for the worker, the targets,
        and the boxes.  
     '''
-    lines = str(warehouse).split('\n')
-    wall_cells = set(warehouse.walls)
-    interior_cells = get_interior_cells(warehouse)
+    width, height, wall, taboo = get_taboo_grid(warehouse)
+    taboo_cell_map = "\n".join(
+        ''.join('#' if wall[i] else 'X' if taboo[i] else ' '
+                for i in range(y * width, (y + 1) * width))
+        for y in range(height))
+    return taboo_cell_map
 
-    taboo_row_nullifier = set(warehouse.targets) | set(find_2D_iterator(lines, '*')) | set(find_2D_iterator(lines, '#'))
-    candidate_taboo_cells = set(find_2D_iterator_exclude(lines, '.', '#', '*', '?'))
+# -----------------------------------------------------------------------------
+MOVES = {'Left': (-1, 0), 'Right': (1, 0), 'Up': (0, -1), 'Down': (0, 1)}
 
-    candidate_taboo_cells &= interior_cells
+# Push directions in the order of their code in integer-coded push actions
+PUSH_DIRECTIONS = ['Up', 'Down', 'Left', 'Right']
 
-    corner_taboo_cells = get_corner_taboo_cells(candidate_taboo_cells, wall_cells)
-    wall_taboo_cells = get_wall_taboo_cells(corner_taboo_cells, taboo_row_nullifier, wall_cells)
-    taboo_cells = (corner_taboo_cells | wall_taboo_cells) & interior_cells
+def get_walk_path(worker_pos, goal_pos, walls, boxes):
+    '''
+    Return a shortest list of moves ('Up', 'Down', 'Left', 'Right') taking the
+    worker from worker_pos to goal_pos without moving any box, or None if
+    goal_pos is not reachable.
+    '''
+    parents = {worker_pos: None}
+    frontier = deque([worker_pos])
+    while frontier:
+        pos = frontier.popleft()
+        if pos == goal_pos:
+            path = []
+            while parents[pos] is not None:
+                pos, action = parents[pos]
+                path.append(action)
+            return path[::-1]
+        x, y = pos
+        for action, (dx, dy) in MOVES.items():
+            nxt = (x + dx, y + dy)
+            if nxt not in walls and nxt not in boxes and nxt not in parents:
+                parents[nxt] = (pos, action)
+                frontier.append(nxt)
+    return None
 
-    taboo_cell_map = get_taboo_cell_map(warehouse, taboo_cells)
+def get_reachable_mask(worker_mask, free_mask, stride, max_steps=None):
+    '''
+    Return the cells the worker can reach without moving any box, on
+    bitboards where cell (x, y) is bit y * stride + x (or x * stride + y,
+    which works the same). Grow the worker region by shifting it one cell in all four directions
+    at once and masking with the free cells until it stops growing. Return
+    the mask of reachable cells, or None if it is still growing after
+    max_steps steps: each step costs a pass over the whole mask, which
+    does not pay off along long corridors (see fill_runs).
+    '''
+    reachable = worker_mask
+    steps = 0
+    while True:
+        grown = reachable | ((reachable << 1) | (reachable >> 1) |
+                             (reachable << stride) | (reachable >> stride)) & free_mask
+        if grown == reachable:
+            return reachable
+        steps += 1
+        if max_steps is not None and steps > max_steps:
+            return None
+        reachable = grown
 
-    return taboo_cell_map
+def fill_runs(free, start, stride):
+    '''
+    Flood fill over a bytearray of 0/1 flags laid out in rows of stride
+    cells, with a border of 0 flags all around. Return the bytearray flagging
+    the free cells connected to the index start. A whole run of free cells
+    along a row is filled at once, so the work is linear in the number of
+    runs, not of cells, whatever the shape of the region.
+    '''
+    filled = bytearray(len(free))
+    stack = [start]
+    while stack:
+        i = stack.pop()
+        if filled[i]:
+            continue
+        left = free.rfind(0, 0, i) + 1
+        right = free.find(0, i)
+        filled[left:right] = b'\x01' * (right - left)
+        # Push one cell of each run touching the run above and the run below
+        for j in (left - stride, left + stride):
+            end = j + right - left
+            j = free.find(1, j, end)
+            while j >= 0:
+                if not filled[j]:
+                    stack.append(j)
+                j = free.find(0, j, end)
+                if j < 0:
+                    break
+                j = free.find(1, j, end)
+    return filled
 
-# -----------------------------------------------------------------------------
-def get_reachable_positions(worker_pos, walls, boxes):
+def get_walk_layers(worker_mask, free_mask, stride):
     '''
-    Compute and return all positions that the worker can reach from worker_pos
-    without moving any box. A standard BFS is used for performance.
+    Same flood fill as get_reachable_mask, but return the list of BFS layers:
+    layers[d] is the mask of the cells at walking distance d from the worker.
     '''
-    visited = {worker_pos}
-    frontier = deque([worker_pos])
+    layers = [worker_mask]
+    reachable = frontier = worker_mask
+    while frontier:
+        frontier = ((frontier << 1) | (frontier >> 1) |
+                    (frontier << stride) | (frontier >> stride)) & free_mask & ~reachable
+        if frontier:
+            layers.append(frontier)
+            reachable |= frontier
+    return layers
+
+def get_walk_steps(worker_mask, targets, free_mask, stride):
+    '''
+    Same flood fill as get_walk_layers, stopped as soon as it has reached
+    every cell of the mask targets, which must all be reachable. Return a
+    dict mapping the bit of each of these cells to its walking distance
+    from the worker.
+    '''
+    steps = {}
+    reachable = frontier = worker_mask
+    d = 0
+    while True:
+        found = frontier & targets
+        while found:
+            low = found & -found
+            steps[low.bit_length() - 1] = d
+            found ^= low
+        targets &= ~frontier
+        if not targets:
+            return steps
+        frontier = ((frontier << 1) | (frontier >> 1) |
+                    (frontier << stride) | (frontier >> stride)) & free_mask & ~reachable
+        reachable |= frontier
+        d += 1
+
+def get_push_distances(interior_cells, target):
+    '''
+    Return a dict mapping each cell from which a box can be pushed to target
+    (ignoring the other boxes) to the minimum number of pushes needed.
+    Computed by a reverse BFS that pulls a box away from target: the box can
+    come from cell c = q - d into cell q only if the worker had room to stand
+    at c - d, so walls on the worker side are honoured.
+    '''
+    distances = {target: 0}
+    frontier = deque([target])
     while frontier:
-        x, y = frontier.popleft()
+        qx, qy = frontier.popleft()
         for dx, dy in [(-1, 0), (1, 0), (0, -1), (0, 1)]:
-            nx, ny = x + dx, y + dy
-            if (nx, ny) not in walls and (nx, ny) not in boxes and (nx, ny) not in visited:
-                visited.add((nx, ny))
-                frontier.append((nx, ny))
-    return visited
+            prev = (qx - dx, qy - dy)
+            worker = (qx - 2 * dx, qy - 2 * dy)
+            if prev in interior_cells and worker in interior_cells and prev not in distances:
+                distances[prev] = distances[(qx, qy)] + 1
+                frontier.append(prev)
+    return distances
+
+def get_tunnel_cells(walls, cells):
+    '''
+    Return a dict mapping each direction of MOVES to the set of the cells c
+    of 'cells' forming a one-wide tunnel along that direction: c and the
+    cell behind it both have walls on their two sides perpendicular to the
+    direction. A box pushed into c can only be pushed on or back, by a
+    worker standing in the tunnel.
+    '''
+    tunnels = {}
+    for direction, (dx, dy) in MOVES.items():
+        walled = {(x, y) for x, y in cells
+                  if (x + dy, y + dx) in walls and (x - dy, y - dx) in walls}
+        tunnels[direction] = {(x, y) for x, y in walled if (x - dx, y - dy) in walled}
+    return tunnels
+
+def get_goal_room_candidates(targets, cells):
+    '''
+    Return the candidate goal rooms (see find_goal_rooms) of a layout,
+    before the boxes and the worker are taken into account, as a list of
+    (size, entrance, door, room) tuples, largest room first.
+    '''
+    candidates = []
+    for entrance in sorted(cells):
+        if entrance in targets:
+            continue
+        x, y = entrance
+        neighbours = [(x + dx, y + dy) for dx, dy in MOVES.values() if (x + dx, y + dy) in cells]
+        if len(neighbours) != 2:
+            continue
+        for door, inside in (neighbours, neighbours[::-1]):
+            room = {inside}
+            frontier = deque([inside])
+            while frontier:
+                rx, ry = frontier.popleft()
+                for dx, dy in MOVES.values():
+                    nxt = (rx + dx, ry + dy)
+                    if nxt in cells and nxt != entrance and nxt not in room:
+                        room.add(nxt)
+                        frontier.append(nxt)
+            behind = (2 * door[0] - x, 2 * door[1] - y)  # where the worker pushes from
+            if door in room or room.isdisjoint(targets) or behind not in cells:
+                continue
+            candidates.append((len(room), entrance, door, frozenset(room)))
+    candidates.sort(reverse=True)
+    return candidates
+
+def find_goal_rooms(warehouse, cells, analysis=None):
+    '''
+    Return the goal rooms of the warehouse as a list of disjoint GoalRoom,
+    cells being the cells the worker can reach (see get_interior_cells).
+    A goal room is a connected area holding targets but no box and not the
+    worker, joined to the rest of the warehouse only through an entrance
+    cell, free of boxes and itself entered from a single door cell. Of
+    nested candidates (a corridor leading to a room), the largest room is
+    kept. Rooms that cannot be filled in any order are dropped.
+    The candidates and the rooms built from them are taken from, and kept
+    in, the LevelAnalysis of the warehouse if one is given.
+    '''
+    targets = set(warehouse.targets)
+    boxes = set(warehouse.boxes)
+    if analysis is None:
+        candidates, built = get_goal_room_candidates(targets, cells), {}
+    else:
+        candidates, built = analysis.goal_room_candidates, analysis.goal_rooms
+    rooms = []
+    taken = set()
+    for _, entrance, door, room in candidates:
+        if warehouse.worker in room or entrance in boxes or not room.isdisjoint(boxes):
+            continue
+        if entrance in taken or not room.isdisjoint(taken):
+            continue
+        goal_room = built.get((entrance, door))
+        if goal_room is None:
+            goal_room = built[(entrance, door)] = GoalRoom(room, entrance, door, targets & room)
+        if goal_room.order is not None:
+            rooms.append(goal_room)
+            taken |= room | {entrance}
+    return rooms
+
+
+class GoalRoom:
+    '''
+    A goal room (see find_goal_rooms). Boxes enter it one at a time, pushed
+    from the door onto the entrance, and are then brought straight to the
+    targets of the room in the packing order self.order: the k-th box goes
+    to order[k], boxes already standing on order[:k]. The order is built
+    backwards, each time removing a target that a box can still reach with
+    all the remaining targets filled, so it never blocks a later target.
+    '''
+
+    def __init__(self, cells, entrance, door, targets):
+        self.cells = frozenset(cells)
+        self.entrance = entrance
+        self.door = door
+        self.direction = next(direction for direction, (dx, dy) in MOVES.items()
+                              if (door[0] + dx, door[1] + dy) == entrance)
+        self.box_cells = self.cells | {entrance}
+        self.worker_cells = self.box_cells | {door}
+        # (number of boxes in the room, weight) -> push path to the next target
+        self.paths = {}
+        filled = set(targets)
+        removed = []
+        while filled:
+            target = next((t for t in sorted(filled)
+                           if self.push_path(filled - {t}, t, 0) is not None), None)
+            if target is None:
+                self.order = None
+                return
+            filled.remove(target)
+            removed.append(target)
+        self.order = removed[::-1]
+
+    def push_path(self, placed, target, weight):
+        '''
+        Return (cost, moves, worker) for the cheapest way to bring a box of
+        the given weight from the entrance, the worker standing on the door,
+        to target, with boxes on the cells of placed: cost counts 1 per
+        step and 1 + weight per push, moves is the list of elementary moves
+        and worker the final worker cell. Return None if there is no way.
+        '''
+        start = (self.entrance, self.door)
+        best = {start: 0}
+        parents = {start: None}
+        frontier = [(0, start)]
+        while frontier:
+            cost, (box, worker) = heapq.heappop(frontier)
+            if cost > best[(box, worker)]:
+                continue
+            if box == target:
+                moves = []
+                position = (box, worker)
+                while parents[position] is not None:
+                    position, move = parents[position]
+                    moves.append(move)
+                return cost, moves[::-1], worker
+            for direction in PUSH_DIRECTIONS:
+                dx, dy = MOVES[direction]
+                nxt = (worker[0] + dx, worker[1] + dy)
+                if nxt == box:
+                    new_box = (box[0] + dx, box[1] + dy)
+                    if new_box not in self.box_cells or new_box in placed:
+                        continue
+                    position, step = (new_box, nxt), 1 + weight
+                elif nxt in self.worker_cells and nxt not in placed:
+                    position, step = (box, nxt), 1
+                else:
+                    continue
+                if cost + step < best.get(position, INF):
+                    best[position] = cost + step
+                    parents[position] = ((box, worker), direction)
+                    heapq.heappush(frontier, (cost + step, position))
+        return None
+
+    def path(self, k, weight):
+        '''Return the push_path of the k-th box of the room, of the given weight.'''
+        key = (k, weight)
+        if key not in self.paths:
+            self.paths[key] = self.push_path(set(self.order[:k]), self.order[k], weight)
+        return self.paths[key]
+
+class MinCostMatching:
+    '''
+    Minimum cost perfect matching of the rows of a square cost matrix to its
+    columns (Hungarian algorithm in its row insertion form). Besides the
+    matching it keeps the dual potentials u and v, so that a single row can
+    be replaced and re-matched in O(n^2) instead of solving from scratch.
+    Costs must be non-negative integers; a cost >= MinCostMatching.BIG marks
+    a forbidden pair.
+    '''
+    BIG = 10 ** 9
+    __slots__ = ('costs', 'u', 'v', 'p')
+
+    def __init__(self, costs):
+        n = len(costs)
+        self.costs = [None] + [[0] + list(row) for row in costs]  # 1-based
+        self.u = [0] * (n + 1)
+        self.v = [0] * (n + 1)
+        self.p = [0] * (n + 1)  # p[j] is the row matched to column j
+        for i in range(1, n + 1):
+            self._insert_row(i)
+
+    def copy(self):
+        '''Return a copy that shares the (never mutated) cost rows.'''
+        clone = MinCostMatching.__new__(MinCostMatching)
+        clone.costs = list(self.costs)
+        clone.u, clone.v, clone.p = list(self.u), list(self.v), list(self.p)
+        return clone
+
+    def replace_row(self, i, row):
+        '''Replace the costs of row i (0-based) and restore an optimal matching.'''
+        i += 1
+        self.p[self.p.index(i, 1)] = 0
+        self.u[i] = 0
+        self.costs[i] = [0] + list(row)
+        self._insert_row(i)
+
+    def cost(self):
+        '''Return the cost of the matching, or INF if it uses a forbidden pair.'''
+        total = sum(self.costs[i][j] for j, i in enumerate(self.p) if i)
+        return total if total < self.BIG else INF
+
+    def _insert_row(self, i):
+        # Grow a shortest augmenting path from the unmatched row i, keeping
+        # u[r] + v[j] <= costs[r][j] with equality on matched pairs.
+        costs, u, v, p = self.costs, self.u, self.v, self.p
+        m = len(p)
+        p[0] = i
+        j0 = 0
+        minv = [INF] * m
+        way = [0] * m
+        used = [False] * m
+        while True:
+            used[j0] = True
+            i0 = p[j0]
+            row = costs[i0]
+            ui0 = u[i0]
+            delta = INF
+            j1 = 0
+            for j in range(1, m):
+                if not used[j]:
+                    cur = row[j] - ui0 - v[j]
+                    if cur < minv[j]:
+                        minv[j] = cur
+                        way[j] = j0
+                    if minv[j] < delta:
+                        delta = minv[j]
+                        j1 = j
+            for j in range(m):
+                if used[j]:
+                    u[p[j]] += delta
+                    v[j] -= delta
+                else:
+                    minv[j] -= delta
+            j0 = j1
+            if p[j0] == 0:
+                break
+        while j0:
+            j1 = way[j0]
+            p[j0] = p[j1]
+            j0 = j1
+
+# -----------------------------------------------------------------------------
+
+class SokobanState(tuple):
+    '''
+    A (worker, boxes, key) state tuple hashed by its Zobrist key.
+    States compare and sort like their (worker, boxes) part; the key is a
+    function of that part, so it never changes an ordering or an equality.
+    '''
+    __slots__ = ()
+
+    def __hash__(self):
+        return self[2]
+
+
+class ZobristTable:
+    '''
+    Random 64-bit codes for the worker on each cell and for a box of each
+    weight on each cell. The key of a state is the XOR of the codes of its
+    worker and boxes, so it can be updated in O(1) when a piece moves.
+    '''
+
+    def __init__(self, cells, weights, seed=0):
+        rng = random.Random(seed)
+        self.worker = {cell: rng.getrandbits(64) for cell in sorted(cells)}
+        self.box = {(x, y, w): rng.getrandbits(64)
+                    for (x, y) in sorted(cells) for w in sorted(set(weights))}
+
+    def key(self, worker, boxes):
+        '''Return the key of a worker position and tuple of (x, y, weight) boxes.'''
+        key = self.worker[worker]
+        for box in boxes:
+            key ^= self.box[box]
+        return key
+
+# -----------------------------------------------------------------------------
+
+# Version of the analysis, part of every layout key so that stale pickles
+# are never loaded
+LEVEL_ANALYSIS_VERSION = 'sokoban-analysis-v1'
+
+class LevelAnalysis:
+    '''
+    Static analysis of a warehouse, which depends only on its layout: the
+    walls, the targets and the region the worker starts in, not on the
+    boxes or their weights.
+    Attributes:
+        key: layout_key of the warehouse.
+        open_cells: set of the cells the worker could ever walk on.
+        cells: sorted list of the cells a box may occupy, the open cells
+            plus boxes and targets in pockets the worker cannot reach;
+            cell_index maps each of them to its index in that list.
+        taboo_set: set of the taboo cells (see taboo_cells).
+        target_list: sorted list of the targets.
+        push_distance: push_distance[t][i] is the number of pushes needed to
+            bring a box from cells[i] to target_list[t], or INF;
+            min_push_distance[i] is the minimum over the targets.
+        dead_cells: set of the cells a box can never leave for a target.
+        tunnels: the tunnel cells of each direction (see get_tunnel_cells).
+        stride: cell (x, y) is bit x * stride + y of the bitmasks used with
+            get_reachable_mask, so that the lowest bit of a mask is its
+            smallest cell; free_mask is the bitmask of cells.
+        goal_room_candidates: see get_goal_room_candidates; goal_rooms maps
+            the (entrance, door) of the candidates used so far by
+            find_goal_rooms to their GoalRoom.
+    '''
+
+    def __init__(self, warehouse):
+        self.key = layout_key(warehouse)
+        walls = set(warehouse.walls)
+        self.open_cells = get_interior_cells(warehouse)
+        self.cells = sorted(self.open_cells | set(warehouse.boxes) | set(warehouse.targets))
+        self.cell_index = {cell: i for i, cell in enumerate(self.cells)}
+        self.taboo_set = get_taboo_cells(warehouse)
+
+        interior_cells = set(self.cells)
+        self.target_list = sorted(warehouse.targets)
+        self.push_distance = []
+        for target in self.target_list:
+            distances = get_push_distances(interior_cells, target)
+            self.push_distance.append([distances.get(cell, INF) for cell in self.cells])
+        self.min_push_distance = [min(column, default=INF) for column in zip(*self.push_distance)]
+        self.dead_cells = self.taboo_set | {cell for cell, d in zip(self.cells, self.min_push_distance)
+                                            if d == INF}
+        self.tunnels = get_tunnel_cells(walls, self.open_cells)
+        self.stride = warehouse.nrows + 1
+        self.bit_cells = {self.bit(cell): cell for cell in self.cells}
+        self.free_mask = self.to_mask(self.cells)
+        self.goal_room_candidates = get_goal_room_candidates(set(warehouse.targets), self.open_cells)
+        self.goal_rooms = {}
+
+    def bit(self, cell):
+        '''Return the bit number of the (x, y) cell.'''
+        return cell[0] * self.stride + cell[1]
+
+    def to_mask(self, cells):
+        '''Return the bitmask of a collection of (x, y) cells.'''
+        mask = 0
+        for x, y in cells:
+            mask |= 1 << x * self.stride + y
+        return mask
+
+    def mask_cells(self, mask):
+        '''Return the list of the cells of a bitmask, lowest bit first.'''
+        cells = []
+        while mask:
+            low = mask & -mask
+            cells.append(self.bit_cells[low.bit_length() - 1])
+            mask ^= low
+        return cells
+
+    def reachable_mask(self, worker, boxes_mask):
+        '''
+        Return the bitmask of the cells the worker can reach among boxes
+        at the cells of boxes_mask (see get_reachable_mask).
+        '''
+        return get_reachable_mask(1 << self.bit(worker), self.free_mask & ~boxes_mask,
+                                  self.stride)
+
+
+def layout_key(warehouse):
+    '''
+    Return a hex digest identifying the layout of the warehouse, shared by
+    all the warehouses with the same LevelAnalysis: the walls, the targets,
+    the cells a box may occupy and, since taboo_cells lets a target under
+    the worker be a corner, the worker if it stands on a target.
+    '''
+    targets = sorted(warehouse.targets)
+    cells = sorted(get_interior_cells(warehouse) | set(warehouse.boxes) | set(targets))
+    worker = warehouse.worker if warehouse.worker in warehouse.targets else None
+    description = repr((LEVEL_ANALYSIS_VERSION, sorted(warehouse.walls), targets, cells, worker))
+    return hashlib.sha256(description.encode()).hexdigest()
+
+
+# layout key -> LevelAnalysis, least recently used first
+_level_analyses = OrderedDict()
+LEVEL_ANALYSIS_CACHE_SIZE = 64
+
+def get_level_analysis(warehouse, cache_dir=None):
+    '''
+    Return the LevelAnalysis of the warehouse, from the in-memory cache of
+    the most recently used layouts when possible.
+    @param cache_dir:
+        optional directory where analyses are also pickled, one
+        <layout key>.pickle file per layout, and looked up on a miss of the
+        in-memory cache. Only point it at a trusted directory: unpickling
+        can run arbitrary code.
+    '''
+    key = layout_key(warehouse)
+    analysis = _level_analyses.get(key)
+    if analysis is not None:
+        _level_analyses.move_to_end(key)
+        return analysis
+    path = cache_dir and os.path.join(cache_dir, key + '.pickle')
+    if path and os.path.exists(path):
+        with open(path, 'rb') as f:
+            analysis = pickle.load(f)
+    else:
+        analysis = LevelAnalysis(warehouse)
+        if path:
+            os.makedirs(cache_dir, exist_ok=True)
+            with open(path, 'wb') as f:
+                pickle.dump(analysis, f, pickle.HIGHEST_PROTOCOL)
+    _level_analyses[key] = analysis
+    if len(_level_analyses) > LEVEL_ANALYSIS_CACHE_SIZE:
+        _level_analyses.popitem(last=False)
+    return analysis
+
+
+class ReachabilityCache:
+    '''
+    Bounded cache of the regions the worker can reach, for the layouts of a
+    LevelAnalysis. A region is the bitmask of its cells (see
+    LevelAnalysis.stride). The regions found so far for a box layout (the
+    bitmask of the box cells) are kept together, so a region is looked up
+    by box layout, then by any of its cells; its lowest bit, its smallest
+    cell, identifies it. Box layouts are evicted least
+    recently used first beyond size.
+    hits, misses and incremental count the regions returned from the
+    cache, by a full flood fill and by an update of the region before a
+    push (see region_after_push).
+    '''
+
+    def __init__(self, analysis, size=100000):
+        self.analysis = analysis
+        self.size = size
+        # box layout -> list of regions, least recently used first
+        self.layouts = OrderedDict()
+        self.hits = self.misses = self.incremental = 0
+
+    def __repr__(self):
+        return "<ReachabilityCache {} layouts, hits={} misses={} incremental={}>".format(
+            len(self.layouts), self.hits, self.misses, self.incremental)
+
+    def hit_rate(self):
+        '''Return the fraction of the regions returned from the cache.'''
+        lookups = self.hits + self.misses + self.incremental
+        return self.hits / lookups if lookups else 0.0
+
+    def lookup(self, layout, bit):
+        '''
+        Return (regions, region): the list of the cached regions of the box
+        layout (None if there are none) and the one holding the cell of
+        the given bit (None if there is none).
+        '''
+        regions = self.layouts.get(layout)
+        if regions is None:
+            return None, None
+        self.layouts.move_to_end(layout)
+        for region in regions:
+            if region >> bit & 1:
+                return regions, region
+        return regions, None
+
+    def store(self, layout, regions, region):
+        '''Add region to the cached regions of the box layout.'''
+        if regions is None:
+            regions = self.layouts[layout] = []
+            if len(self.layouts) > self.size:
+                self.layouts.popitem(last=False)
+        regions.append(region)
+
+    def region(self, worker, boxes_xy):
+        '''Return the region of the worker cell among boxes at the cells boxes_xy.'''
+        analysis = self.analysis
+        layout = analysis.to_mask(boxes_xy)
+        bit = analysis.bit(worker)
+        regions, region = self.lookup(layout, bit)
+        if region is not None:
+            self.hits += 1
+            return region
+        self.misses += 1
+        region = get_reachable_mask(1 << bit, analysis.free_mask & ~layout, analysis.stride)
+        self.store(layout, regions, region)
+        return region
+
+    def region_after_push(self, region, new_box, worker, boxes_xy):
+        '''
+        Return the region of the worker after a push along a straight line
+        that left the box at new_box, the worker at worker and the boxes at
+        boxes_xy, region being the region of the worker before the push.
+        The cells the box left are flooded from the worker, on top of the
+        old region; if the box now stands in the old region, the 8 cells
+        around it must show that it does not cut the region in two,
+        otherwise the region is flooded from scratch.
+        '''
+        analysis = self.analysis
+        layout = analysis.to_mask(boxes_xy)
+        bit = analysis.bit(worker)
+        regions, cached = self.lookup(layout, bit)
+        if cached is not None:
+            self.hits += 1
+            return cached
+        if region >> analysis.bit(new_box) & 1 and not self.stays_connected(region, new_box, worker):
+            self.misses += 1
+            start = 1 << bit
+        else:
+            self.incremental += 1
+            start = region & ~layout | 1 << bit
+        region = get_reachable_mask(start, analysis.free_mask & ~layout, analysis.stride)
+        self.store(layout, regions, region)
+        return region
+
+    def stays_connected(self, region, box, worker):
+        '''
+        Return True if the free neighbours of the cell box, the cells of
+        region and the worker cell, are connected through the 8 cells
+        around it, so that a box on it cannot disconnect region.
+        '''
+        x, y = box
+        ring = [(x - 1, y - 1), (x, y - 1), (x + 1, y - 1), (x + 1, y),
+                (x + 1, y + 1), (x, y + 1), (x - 1, y + 1), (x - 1, y)]
+        stride = self.analysis.stride
+        free = [cell == worker or region >> cell[0] * stride + cell[1] & 1 for cell in ring]
+        # Number the runs of consecutive free cells around the ring, the
+        # run wrapping around the end of the list being one run
+        runs = []
+        run = 0
+        for flag in free:
+            if not flag:
+                run += 1
+            runs.append(run)
+        if free[0] and free[-1]:
+            runs = [0 if r == run else r for r in runs]
+        return len({runs[k] for k in (1, 3, 5, 7) if free[k]}) <= 1
 
 # -----------------------------------------------------------------------------
 
@@ -226,29 +1020,79 @@ class SokobanPuzzle(search.Problem):
     An instance of SokobanPuzzle represents a weighted Sokoban puzzle.
     It holds the walls, targets, weighted boxes, worker position, taboo cells, and
     precomputed data to accelerate the solver.
+    States are SokobanState tuples (worker, boxes, key) where boxes is a
+    tuple of (x, y, weight) sorted in reading order and key is the Zobrist
+    key of the state.
     '''
     
-    def __init__(self, warehouse):
+    def __init__(self, warehouse, heuristic='matching', pattern_db=None, analysis_dir=None):
+        '''
+        @param heuristic:
+            'matching' (default) lower-bounds the cost by a minimum cost
+            assignment of boxes to distinct targets, 'nearest' sends every
+            box to its nearest target.
+        @param pattern_db:
+            optional deadlock pattern database (a PatternDatabase or the path
+            of a file built by deadlock_patterns.py) looked up after each push.
+        @param analysis_dir:
+            optional directory where the LevelAnalysis of the layout is
+            pickled (see get_level_analysis).
+        '''
         self.warehouse = warehouse
         self.walls = set(warehouse.walls)
         self.targets = set(warehouse.targets)
-        self.deadlock_cache = {}
+        # (pushed box, boxes around it) -> freeze deadlock, least recently used first
+        self.deadlock_cache = OrderedDict()
+        self.deadlock_cache_size = 100000
+        if heuristic not in ('matching', 'nearest'):
+            raise ValueError(f"Unknown heuristic: {heuristic!r}")
+        self.heuristic = heuristic
+        # box layout -> (boxes in row order, MinCostMatching), least recently used first
+        self.matching_cache = OrderedDict()
+        self.matching_cache_size = 2000
+        if isinstance(pattern_db, str):
+            pattern_db = PatternDatabase(pattern_db)
+        self.pattern_db = pattern_db
+        # Static data shared by all the levels with the same layout
+        self.analysis = analysis = get_level_analysis(warehouse, analysis_dir)
+        # Cells the worker could ever walk on; anything else is a wall for the patterns
+        self.open_cells = analysis.open_cells
 
         boxes_with_weights = [(box[0], box[1], weight)
                               for box, weight in zip(warehouse.boxes, warehouse.weights)]
         boxes_with_weights.sort(key=lambda b: (b[1], b[0]))
-        self.initial = (warehouse.worker, tuple(boxes_with_weights))
+        self.zobrist = ZobristTable(analysis.cells, warehouse.weights)
+        boxes_with_weights = tuple(boxes_with_weights)
+        self.initial = SokobanState((warehouse.worker, boxes_with_weights,
+                                     self.zobrist.key(warehouse.worker, boxes_with_weights)))
+
+        self.taboo_set = analysis.taboo_set
 
-        taboo_map = taboo_cells(warehouse)
-        self.taboo_set = {(j, i)
-                          for i, line in enumerate(taboo_map.splitlines())
-                          for j, ch in enumerate(line)
-                          if ch == 'X'}
+        # Dense tables of push distances: push_distance[t][i] is the number
+        # of pushes needed to bring a box from cell i to target t, or INF
+        self.cells = analysis.cells
+        self.cell_index = analysis.cell_index
+        self.target_list = analysis.target_list
+        self.push_distance = analysis.push_distance
+        self.min_push_distance = analysis.min_push_distance
+        # Cells a box can never leave for a target
+        self.dead_cells = analysis.dead_cells
 
-        # Memoized function to compute minimum target distance for any cell
-        self.compute_min_target_distance = search.memoize(
-            lambda bx, by: min(abs(bx - tx) + abs(by - ty) for (tx, ty) in self.targets)
-        )
+        # Packed states (see pack): the worker cell index, then for each box
+        # its cell index and, unless all boxes weigh the same, the index of
+        # its weight in weight_table, one byte each when they fit
+        self.weight_table = sorted(set(warehouse.weights))
+        fields = 1 + len(warehouse.boxes) * (1 if len(self.weight_table) <= 1 else 2)
+        width = 'B' if max(len(self.cells), len(self.weight_table)) <= 256 else 'H'
+        self.state_struct = struct.Struct('<%d%s' % (fields, width))
+        self.record_size = self.state_struct.size
+        # The packed fields of each worker cell and of each possible box
+        field = struct.Struct('<' + width)
+        self.worker_fields = {cell: field.pack(i) for i, cell in enumerate(self.cells)}
+        self.box_fields = {cell + (w,): field.pack(i) if len(self.weight_table) <= 1 else
+                           field.pack(i) + field.pack(j)
+                           for i, cell in enumerate(self.cells)
+                           for j, w in enumerate(self.weight_table)}
 
     def __eq__(self, other):
         return isinstance(other, SokobanPuzzle) and self.initial == other.initial
@@ -256,11 +1100,30 @@ class SokobanPuzzle(search.Problem):
     def __hash__(self):
         return hash(self.initial)
 
+    def pack(self, state):
+        '''Return the state as a bytes record of record_size bytes.'''
+        worker, boxes, _ = state
+        return self.worker_fields[worker] + b''.join(map(self.box_fields.__getitem__, boxes))
+
+    def unpack(self, record):
+        '''Return the state packed in record by pack.'''
+        fields = self.state_struct.unpack(record)
+        cells = self.cells
+        if len(self.weight_table) <= 1:
+            weight = self.weight_table[0] if self.weight_table else 0
+            boxes = tuple(cells[i] + (weight,) for i in fields[1:])
+        else:
+            boxes = tuple(cells[i] + (self.weight_table[j],)
+                          for i, j in zip(fields[1::2], fields[2::2]))
+        worker = cells[fields[0]]
+        return SokobanState((worker, boxes, self.zobrist.key(worker, boxes)))
+
     def actions(self, state):
         directions = ['Up', 'Down', 'Left', 'Right']
-        (wx, wy), boxes = state
+        (wx, wy), boxes, _ = state
         boxes_xy = {(b[0], b[1]) for b in boxes}
-        reachable = get_reachable_positions((wx, wy), self.walls, boxes_xy)
+        # A single step needs no reachability test: a free neighbour of the
+        # worker is always reachable
         moves = {'Left': (-1, 0), 'Right': (1, 0), 'Up': (0, -1), 'Down': (0, 1)}
         legal_actions = []
         for action in directions:
@@ -272,32 +1135,97 @@ class SokobanPuzzle(search.Problem):
                 bnx, bny = nx + dx, ny + dy
                 if (bnx, bny) in self.walls or (bnx, bny) in boxes_xy or (bnx, bny) in self.taboo_set:
                     continue
-                if (wx, wy) in reachable:
-                    legal_actions.append(action)
-            else:
-                if (nx, ny) in reachable:
-                    legal_actions.append(action)
+                if self.is_freeze_deadlock((nx, ny), (bnx, bny), boxes_xy):
+                    continue
+                if self.is_pattern_deadlock((nx, ny), (bnx, bny), boxes_xy):
+                    continue
+            legal_actions.append(action)
         return legal_actions
 
+    def is_freeze_deadlock(self, box, new_box, boxes_xy):
+        '''
+        Return True if pushing the box at position box to new_box freezes it,
+        i.e. it can no longer move along either axis, next to a group of
+        frozen boxes that are not all on targets.
+        Only the boxes within FREEZE_RADIUS of new_box are considered, which
+        keeps the test sound and lets the result be cached by that local
+        neighbourhood in self.deadlock_cache.
+        '''
+        nx, ny = new_box
+        r = FREEZE_RADIUS
+        nearby = frozenset(b for b in boxes_xy
+                           if b != box and abs(b[0] - nx) <= r and abs(b[1] - ny) <= r)
+        key = (new_box, nearby)
+        cache = self.deadlock_cache
+        deadlock = cache.get(key)
+        if deadlock is None:
+            frozen = []
+            deadlock = self._is_frozen(new_box, nearby | {new_box}, set(), frozen) and \
+                not all(b in self.targets for b in frozen)
+            cache[key] = deadlock
+            if len(cache) > self.deadlock_cache_size:
+                cache.popitem(last=False)
+        else:
+            cache.move_to_end(key)
+        return deadlock
+
+    def is_pattern_deadlock(self, box, new_box, boxes_xy):
+        '''
+        Return True if pushing the box at position box to new_box creates a
+        deadlock pattern of self.pattern_db around new_box. Always False
+        when the puzzle has no pattern database.
+        '''
+        if self.pattern_db is None:
+            return False
+        boxes_after = (boxes_xy - {box}) | {new_box}
+        return self.pattern_db.is_deadlock(new_box, boxes_after, self.open_cells, self.targets)
+
+    def _is_frozen(self, box, boxes, blockers, frozen):
+        # A box is frozen when it is blocked both horizontally and vertically.
+        # It is blocked along an axis by a wall on either side, by dead cells
+        # on both sides, or by a neighbouring box that is itself frozen once
+        # this box is treated as a wall (blockers holds those boxes).
+        # Boxes found frozen are appended to frozen; both lists are rolled
+        # back when the box turns out not to be frozen.
+        saved_blockers, saved_frozen = set(blockers), len(frozen)
+        blockers.add(box)
+        x, y = box
+        for side1, side2 in (((x - 1, y), (x + 1, y)), ((x, y - 1), (x, y + 1))):
+            if side1 in self.walls or side2 in self.walls or side1 in blockers or side2 in blockers:
+                continue
+            if side1 in self.dead_cells and side2 in self.dead_cells:
+                continue
+            if any(side in boxes and self._is_frozen(side, boxes, blockers, frozen)
+                   for side in (side1, side2)):
+                continue
+            blockers.intersection_update(saved_blockers)
+            del frozen[saved_frozen:]
+            return False
+        frozen.append(box)
+        return True
+
     def result(self, state, action):
-        (wx, wy), boxes = state
-        boxes = list(boxes)
+        (wx, wy), boxes, key = state
         dx, dy = {'Left': (-1, 0), 'Right': (1, 0), 'Up': (0, -1), 'Down': (0, 1)}[action]
         new_worker = (wx + dx, wy + dy)
+        key ^= self.zobrist.worker[(wx, wy)] ^ self.zobrist.worker[new_worker]
         for i, (bx, by, w) in enumerate(boxes):
             if (bx, by) == new_worker:
                 new_box = (bx + dx, by + dy, w)
+                key ^= self.zobrist.box[boxes[i]] ^ self.zobrist.box[new_box]
+                boxes = list(boxes)
                 boxes[i] = new_box
+                boxes = tuple(sorted(boxes, key=lambda b: (b[1], b[0])))
                 break
-        return (new_worker, tuple(sorted(boxes, key=lambda b: (b[1], b[0]))))
+        return SokobanState((new_worker, boxes, key))
 
     def goal_test(self, state):
-        _, boxes = state
+        boxes = state[1]
         return all((b[0], b[1]) in self.targets for b in boxes)
 
     def path_cost(self, c, state1, action, state2):
-        _, b1 = state1
-        _, b2 = state2
+        b1 = state1[1]
+        b2 = state2[1]
         moved_box = None
         b1_xy = {(b[0], b[1]): b for b in b1}
         b2_xy = {(b[0], b[1]): b for b in b2}
@@ -310,15 +1238,659 @@ class SokobanPuzzle(search.Problem):
         return c + 1
 
     def h(self, node):
-        _, boxes = node.state
+        if self.heuristic == 'matching':
+            return self.matching_cost(node)
+        boxes = node.state[1]
         box_cost = 0
         for bx, by, weight in boxes:
             if (bx, by) in self.targets:
                 continue
-            d = self.compute_min_target_distance(bx, by)
+            d = self.min_push_distance[self.cell_index[(bx, by)]]
             box_cost += d * (1 + weight)
         return box_cost
 
+    def matching_costs(self, box):
+        '''Return the row of weighted push costs from box to every target.'''
+        bx, by, weight = box
+        i = self.cell_index[(bx, by)]
+        big = MinCostMatching.BIG
+        return [column[i] * (1 + weight) if column[i] < INF else big
+                for column in self.push_distance]
+
+    def matching_cost(self, node):
+        '''
+        Cost of a minimum cost assignment of the boxes of node to distinct
+        targets, each box costing its push distance times (1 + weight).
+        INF when no assignment avoids an unreachable target.
+        '''
+        parent_boxes = node.parent.state[1] if node.parent else None
+        return self.matching_entry(node.state[1], parent_boxes)[1].cost()
+
+    def matching_entry(self, boxes, parent_boxes=None):
+        '''
+        Return the cached (boxes in row order, MinCostMatching) entry of the
+        box layout boxes. The assignment of the parent layout parent_boxes
+        is reused when only one box moved; it is rebuilt if it was evicted,
+        as the siblings of boxes will need it too.
+        '''
+        cache = self.matching_cache
+        entry = cache.get(boxes)
+        if entry is not None:
+            cache.move_to_end(boxes)
+            return entry
+        if parent_boxes is not None:
+            rows, matching = self.matching_entry(parent_boxes)
+            moved = [b for b in rows if b not in boxes]
+            if len(moved) == 1:
+                new_box, = [b for b in boxes if b not in rows]
+                i = rows.index(moved[0])
+                rows = rows[:i] + (new_box,) + rows[i + 1:]
+                matching = matching.copy()
+                matching.replace_row(i, self.matching_costs(new_box))
+                entry = (rows, matching)
+        if entry is None:
+            entry = (boxes, MinCostMatching([self.matching_costs(b) for b in boxes]))
+        cache[boxes] = entry
+        if len(cache) > self.matching_cache_size:
+            cache.popitem(last=False)
+        return entry
+
+def distinct_permutations(items):
+    '''Generate the distinct orderings of the multiset items, as tuples.'''
+    items = sorted(items)
+    if not items:
+        yield ()
+        return
+    for i, item in enumerate(items):
+        if i > 0 and item == items[i - 1]:
+            continue
+        for rest in distinct_permutations(items[:i] + items[i + 1:]):
+            yield (item,) + rest
+
+
+class SokobanPullPuzzle(SokobanPuzzle):
+    '''
+    Reverse formulation of the weighted Sokoban puzzle, for the backward
+    half of search.bidirectional_uniform_cost_search.
+    The search starts from every goal state that can end a solution: each
+    assignment of the box weights to targets, with the worker standing
+    where the last push of a box onto its target leaves it.
+    An action (direction, pull) undoes a forward move in direction: the
+    worker steps back against direction and, if pull is True, drags along
+    the box in front of it. Its cost is the cost of the forward move, and
+    states are SokobanState tuples with the same Zobrist keys as in
+    SokobanPuzzle, so both searches meet on equal states.
+    '''
+
+    def __init__(self, warehouse, **options):
+        super().__init__(warehouse, **options)
+        # The forward initial state is the goal of the reverse search
+        self.goal = self.initial
+        self.initial = None
+        self.initials = []
+        if set(warehouse.boxes) <= self.targets:
+            self.initials.append(self.goal)  # solved without any push
+        n_boxes = len(warehouse.boxes)
+        for cells in combinations(sorted(self.targets), n_boxes):
+            # the last push moved a box from (x - dx, y - dy) to (x, y)
+            free = self.open_cells - set(cells)
+            workers = sorted({(x - dx, y - dy) for x, y in cells for dx, dy in MOVES.values()
+                              if (x - dx, y - dy) in free and (x - 2 * dx, y - 2 * dy) in free})
+            for weights in distinct_permutations(warehouse.weights):
+                boxes = tuple(sorted(((x, y, w) for (x, y), w in zip(cells, weights)),
+                                     key=lambda b: (b[1], b[0])))
+                for worker in workers:
+                    self.initials.append(
+                        SokobanState((worker, boxes, self.zobrist.key(worker, boxes))))
+
+    def actions(self, state):
+        (wx, wy), boxes, _ = state
+        boxes_xy = {(b[0], b[1]) for b in boxes}
+        legal_actions = []
+        for direction in ['Up', 'Down', 'Left', 'Right']:
+            dx, dy = MOVES[direction]
+            previous = (wx - dx, wy - dy)
+            if previous in self.walls or previous in boxes_xy:
+                continue
+            legal_actions.append((direction, False))
+            if (wx + dx, wy + dy) in boxes_xy:
+                legal_actions.append((direction, True))
+        return legal_actions
+
+    def result(self, state, action):
+        (wx, wy), boxes, key = state
+        direction, pull = action
+        dx, dy = MOVES[direction]
+        new_worker = (wx - dx, wy - dy)
+        key ^= self.zobrist.worker[(wx, wy)] ^ self.zobrist.worker[new_worker]
+        if pull:
+            boxes = list(boxes)
+            i = [(b[0], b[1]) for b in boxes].index((wx + dx, wy + dy))
+            new_box = (wx, wy, boxes[i][2])
+            key ^= self.zobrist.box[boxes[i]] ^ self.zobrist.box[new_box]
+            boxes[i] = new_box
+            boxes = tuple(sorted(boxes, key=lambda b: (b[1], b[0])))
+        return SokobanState((new_worker, boxes, key))
+
+    def goal_test(self, state):
+        return state == self.goal
+
+    def forward_action(self, action):
+        '''Return the elementary forward move undone by action.'''
+        return action[0]
+
+
+class SokobanMacroPuzzle(SokobanPuzzle):
+    '''
+    Push-level formulation of the weighted Sokoban puzzle.
+    An action is a macro move: the worker walks 'walk' steps to the cell
+    behind the i-th box of the state, then pushes it in the d-th direction
+    of PUSH_DIRECTIONS, 1 + run times (run is 0 without macros), or, when
+    run is self.room_run, onto the entrance of a goal room and on to the
+    next target of the room. It is coded as the integer
+    ((walk * max_run + run) * number of boxes + i) * 4 + d, which keeps
+    search nodes small; decode_action turns it back into
+    ((bx, by, weight), direction, walk, run).
+    States are the same as in SokobanPuzzle, with the worker standing
+    behind the pushed box.
+    The step cost is the walk plus the cost of the pushes (and of the
+    moves in the goal room), so path costs are identical to the
+    elementary formulation.
+    With normalize=True, the worker of a state is instead the smallest
+    cell of the region it can reach (see canonical_worker), so positions
+    differing only by where the worker stands in that region are a single
+    state. The walk of an action is then unknown and coded as 0: path
+    costs count the pushes (and the goal room moves) only, and the walks
+    are worked out by expand_actions from the actual worker position.
+    '''
+
+    def __init__(self, warehouse, heuristic='matching', corral_pruning=False, pattern_db=None,
+                 macros=False, normalize=False, analysis_dir=None):
+        '''
+        @param corral_pruning:
+            'deadlock' prunes states with a corral proven to be a deadlock,
+            which keeps the search optimal.
+            True also restricts the pushes to those into a PI-corral when
+            there is one. Solutions stay legal but, since walking costs are
+            not part of the corral argument, their cost is no longer
+            guaranteed optimal.
+        @param macros:
+            if True, a box pushed into a tunnel (see get_tunnel_cells) is
+            pushed on in one action until it leaves the tunnel, reaches a
+            target or is blocked, and a box pushed into a goal room (see
+            find_goal_rooms) is taken straight to the next target of its
+            packing order; boxes in a goal room are not pushed again.
+            Costs stay exact but solutions are no longer guaranteed optimal.
+        @param normalize:
+            if True, states store the canonical worker cell (see above).
+            The search is then optimal in pushes, weighted by the box
+            weights, but not in total cost, walks included.
+        '''
+        super().__init__(warehouse, heuristic, pattern_db, analysis_dir)
+        self.num_boxes = len(warehouse.boxes)
+        self.macros = macros
+        self.normalize = normalize
+        self.reachability = ReachabilityCache(self.analysis)
+        if normalize:
+            _, boxes, key = self.initial
+            worker = self.canonical_worker(warehouse.worker, {(b[0], b[1]) for b in boxes})
+            key ^= self.zobrist.worker[warehouse.worker] ^ self.zobrist.worker[worker]
+            self.initial = SokobanState((worker, boxes, key))
+        if macros:
+            self.tunnels = self.analysis.tunnels
+            self.goal_rooms = find_goal_rooms(warehouse, self.open_cells, self.analysis)
+        else:
+            self.tunnels = {direction: set() for direction in MOVES}
+            self.goal_rooms = []
+        self.room_entrances = {room.entrance: room for room in self.goal_rooms}
+        self.room_of = {cell: room for room in self.goal_rooms for cell in room.cells}
+        # A straight run is shorter than the number of cells
+        self.room_run = len(self.cells) if macros else -1
+        self.max_run = len(self.cells) + 1 if macros else 1
+        self.corral_pruning = corral_pruning
+        # (corral boxes, worker cell) -> deadlock proven by the sub-search
+        self.corral_cache = OrderedDict()
+        self.corral_cache_size = 10000
+        self.corral_search_limit = 1000
+
+    def actions(self, state):
+        worker, boxes, _ = state
+        boxes_xy = {(b[0], b[1]) for b in boxes}
+        region = self.reachability.region(worker, boxes_xy)
+        stride = self.analysis.stride
+        pushes = []  # (bit of the cell behind the box, run, i, d)
+        for i, (bx, by, _) in enumerate(boxes):
+            if (bx, by) in self.room_of:
+                continue  # already in place in a goal room
+            for d, direction in enumerate(PUSH_DIRECTIONS):
+                dx, dy = MOVES[direction]
+                behind = (bx - dx) * stride + by - dy
+                if not region >> behind & 1:
+                    continue
+                nxt = (bx + dx, by + dy)
+                if nxt in self.walls or nxt in boxes_xy or nxt in self.taboo_set:
+                    continue
+                run = 0
+                if self.macros:
+                    room = self.room_entrances.get(nxt)
+                    if room is not None and self.room_box_count(room, boxes_xy) is not None:
+                        pushes.append((behind, self.room_run, i, d))
+                        continue
+                    nxt, run = self.tunnel_run(nxt, direction, boxes_xy)
+                if self.is_freeze_deadlock((bx, by), nxt, boxes_xy):
+                    continue
+                if self.is_pattern_deadlock((bx, by), nxt, boxes_xy):
+                    continue
+                pushes.append((behind, run, i, d))
+        if self.normalize:
+            # The walks are left out of the costs, any cell of the region will do
+            walks = None
+        else:
+            # Walk only as far as the last cell behind a pushable box
+            targets = 0
+            for behind, _, _, _ in pushes:
+                targets |= 1 << behind
+            walks = get_walk_steps(1 << self.analysis.bit(worker), targets, region, stride)
+        legal_actions = [(((0 if walks is None else walks[behind]) * self.max_run + run)
+                          * self.num_boxes + i) * 4 + d for behind, run, i, d in pushes]
+        if self.corral_pruning:
+            reachable = set(self.analysis.mask_cells(region))
+            return self.corral_actions(worker, boxes, boxes_xy, reachable, legal_actions)
+        return legal_actions
+
+    def decode_action(self, state, action):
+        '''
+        Return the ((bx, by, weight), direction, walk, run) macro move coded
+        by the integer action in the given state.
+        '''
+        rest, d = divmod(action, 4)
+        rest, i = divmod(rest, self.num_boxes)
+        walk, run = divmod(rest, self.max_run)
+        return state[1][i], PUSH_DIRECTIONS[d], walk, run
+
+    def canonical_worker(self, worker, boxes_xy):
+        '''
+        Return the smallest cell of the region the worker can reach among
+        the boxes at boxes_xy, the same for every worker cell of the region.
+        '''
+        region = self.reachability.region(worker, boxes_xy)
+        return self.analysis.bit_cells[(region & -region).bit_length() - 1]
+
+    def tunnel_run(self, cell, direction, boxes_xy):
+        '''
+        Return (last cell, number of extra pushes) for a box pushed into
+        cell in the given direction and pushed on along a tunnel until it
+        leaves it, reaches a target, or the next cell is blocked, taboo or
+        the entrance of a goal room.
+        '''
+        dx, dy = MOVES[direction]
+        tunnel = self.tunnels[direction]
+        run = 0
+        while cell in tunnel and cell not in self.targets:
+            nxt = (cell[0] + dx, cell[1] + dy)
+            if nxt in self.walls or nxt in boxes_xy or nxt in self.taboo_set or \
+                    nxt in self.room_entrances:
+                break
+            cell = nxt
+            run += 1
+        return cell, run
+
+    def room_box_count(self, room, boxes_xy):
+        '''
+        Return the number k of boxes in the goal room if they stand on the
+        first k targets of its packing order and the room is not full,
+        otherwise None.
+        '''
+        placed = {b for b in boxes_xy if b in room.cells}
+        k = len(placed)
+        if k < len(room.order) and placed == set(room.order[:k]):
+            return k
+        return None
+
+    def room_push(self, state, box, direction):
+        '''
+        Return (target, cost, moves, worker) for the box (bx, by, weight)
+        pushed in direction onto the entrance of a goal room in state: the
+        target it is taken to and the push_path of the room from there.
+        '''
+        bx, by, weight = box
+        dx, dy = MOVES[direction]
+        room = self.room_entrances[(bx + dx, by + dy)]
+        k = self.room_box_count(room, {(b[0], b[1]) for b in state[1]})
+        cost, moves, worker = room.path(k, weight)
+        return room.order[k], cost, moves, worker
+
+    def get_corrals(self, boxes_xy, reachable):
+        '''
+        Return the corrals of a position as a list of (cells, boxes) pairs:
+        cells is a connected area of free cells the worker cannot reach and
+        boxes is the set of boxes bordering it, which together with the
+        walls seal it off from the worker.
+        '''
+        corrals = []
+        seen = set()
+        for start in self.open_cells:
+            if start in seen or start in reachable or start in boxes_xy:
+                continue
+            cells, fence = {start}, set()
+            frontier = deque([start])
+            while frontier:
+                x, y = frontier.popleft()
+                for dx, dy in [(-1, 0), (1, 0), (0, -1), (0, 1)]:
+                    nxt = (x + dx, y + dy)
+                    if nxt in boxes_xy:
+                        fence.add(nxt)
+                    elif nxt not in self.walls and nxt not in cells:
+                        cells.add(nxt)
+                        frontier.append(nxt)
+            seen |= cells
+            corrals.append((cells, fence))
+        return corrals
+
+    def corral_actions(self, worker, boxes, boxes_xy, reachable, legal_actions):
+        '''
+        Filter legal_actions with corral analysis. Return [] if some corral
+        is proven to be a deadlock. Otherwise, unless corral_pruning is
+        'deadlock', if there is a PI-corral that still needs work, return
+        only the pushes of its fence boxes:
+        the worker will have to push them anyway and, in a PI-corral, no
+        other push can help to do it.
+        '''
+        best = None
+        for cells, fence in self.get_corrals(boxes_xy, reachable):
+            if self.is_corral_deadlock(worker, fence, cells):
+                return []
+            if self.corral_pruning == 'deadlock':
+                continue
+            if not any(b not in self.targets for b in fence) and \
+                    not any(c in self.targets for c in cells):
+                continue  # nothing left to do in this corral
+            if self.is_pi_corral(fence, cells, boxes_xy, reachable):
+                pushes = [a for a in legal_actions
+                          if boxes[a // 4 % self.num_boxes][:2] in fence]
+                if best is None or len(pushes) < len(best):
+                    best = pushes
+        return legal_actions if best is None else best
+
+    def is_pi_corral(self, fence, cells, boxes_xy, reachable):
+        '''
+        Return True if, as long as the fence stands, every push of a fence
+        box can only move it into the corral (I), and every such push is
+        available to the worker right now (P). Pushes blocked by other
+        boxes or not yet reachable count, as moving other boxes may enable
+        them later.
+        '''
+        for bx, by in fence:
+            for dx, dy in [(-1, 0), (1, 0), (0, -1), (0, 1)]:
+                behind, nxt = (bx - dx, by - dy), (bx + dx, by + dy)
+                if behind in self.walls or behind in cells or nxt in self.walls:
+                    continue  # impossible while the corral is closed
+                if nxt not in cells or behind not in reachable:
+                    return False
+        return True
+
+    def is_corral_deadlock(self, worker, fence, cells):
+        '''
+        Prove that a corral is a deadlock with a small push-level search on
+        the fence boxes alone (other boxes removed, which can only make the
+        problem easier). The corral is a deadlock if the search exhausts all
+        positions without getting every fence box on a target or letting
+        the worker into the corral. Unknown (False) if the search exceeds
+        self.corral_search_limit positions. Results are cached by
+        (fence, worker cell).
+        '''
+        key = (frozenset(fence), worker)
+        cache = self.corral_cache
+        deadlock = cache.get(key)
+        if deadlock is not None:
+            cache.move_to_end(key)
+            return deadlock
+        deadlock = True
+        analysis = self.analysis
+        cells_mask = analysis.to_mask(cells)
+        start = frozenset(fence)
+        reachable = analysis.reachable_mask(worker, analysis.to_mask(start))
+        visited = {(reachable & -reachable, start)}
+        frontier = deque([(reachable, start)])
+        while frontier and deadlock:
+            if len(visited) > self.corral_search_limit:
+                deadlock = False
+                break
+            reachable, boxes = frontier.popleft()
+            if reachable & cells_mask or all(b in self.targets for b in boxes):
+                deadlock = False
+                break
+            for bx, by in boxes:
+                for dx, dy in [(-1, 0), (1, 0), (0, -1), (0, 1)]:
+                    nxt = (bx + dx, by + dy)
+                    if not reachable >> analysis.bit((bx - dx, by - dy)) & 1 or \
+                            nxt in self.walls or nxt in boxes or nxt in self.dead_cells or \
+                            self.is_freeze_deadlock((bx, by), nxt, boxes):
+                        continue
+                    new_boxes = boxes - {(bx, by)} | {nxt}
+                    new_reachable = analysis.reachable_mask((bx, by), analysis.to_mask(new_boxes))
+                    signature = (new_reachable & -new_reachable, new_boxes)
+                    if signature not in visited:
+                        visited.add(signature)
+                        frontier.append((new_reachable, new_boxes))
+        cache[key] = deadlock
+        if len(cache) > self.corral_cache_size:
+            cache.popitem(last=False)
+        return deadlock
+
+    def result(self, state, action):
+        worker, boxes, key = state
+        box, direction, _, run = self.decode_action(state, action)
+        bx, by, w = box
+        dx, dy = MOVES[direction]
+        if run == self.room_run:
+            (nx, ny), _, _, new_worker = self.room_push(state, box, direction)
+        else:
+            nx, ny = bx + (run + 1) * dx, by + (run + 1) * dy
+            new_worker = (nx - dx, ny - dy)
+        new_box = (nx, ny, w)
+        new_boxes = [b if b != box else new_box for b in boxes]
+        if self.normalize:
+            new_boxes_xy = {(b[0], b[1]) for b in new_boxes}
+            if run == self.room_run:
+                region = self.reachability.region(new_worker, new_boxes_xy)
+            else:
+                region = self.reachability.region_after_push(
+                    self.reachability.region(worker, {(b[0], b[1]) for b in boxes}),
+                    (nx, ny), new_worker, new_boxes_xy)
+            new_worker = self.analysis.bit_cells[(region & -region).bit_length() - 1]
+        key ^= self.zobrist.worker[worker] ^ self.zobrist.worker[new_worker] ^ \
+            self.zobrist.box[box] ^ self.zobrist.box[new_box]
+        return SokobanState((new_worker, tuple(sorted(new_boxes, key=lambda b: (b[1], b[0]))), key))
+
+    def path_cost(self, c, state1, action, state2):
+        rest, d = divmod(action, 4)
+        rest, i = divmod(rest, self.num_boxes)
+        walk, run = divmod(rest, self.max_run)
+        box = state1[1][i]
+        if run == self.room_run:
+            return c + walk + 1 + box[2] + self.room_push(state1, box, PUSH_DIRECTIONS[d])[1]
+        return c + walk + (run + 1) * (1 + box[2])
+
+    def expand_actions(self, macro_actions):
+        '''
+        Translate a sequence of macro actions applied from the initial state
+        into the equivalent list of elementary worker moves, walking the
+        worker along shortest paths from where it actually stands (which,
+        with normalize, is not the worker of the states).
+        '''
+        state = self.initial
+        worker = self.warehouse.worker
+        elem_actions = []
+        for action in macro_actions:
+            boxes = state[1]
+            box, direction, _, run = self.decode_action(state, action)
+            dx, dy = MOVES[direction]
+            elem_actions += get_walk_path(worker, (box[0] - dx, box[1] - dy), self.walls,
+                                          {(b[0], b[1]) for b in boxes})
+            elem_actions.append(direction)
+            if run == self.room_run:
+                _, _, moves, worker = self.room_push(state, box, direction)
+                elem_actions += moves
+            else:
+                elem_actions += [direction] * run
+                worker = (box[0] + run * dx, box[1] + run * dy)
+            state = self.result(state, action)
+        return elem_actions
+
+
+def expand_pushes(worker, boxes, walls, pushes):
+    '''
+    Translate a sequence of pushes ((bx, by), direction) applied from the
+    given worker position and set of box positions into the equivalent list
+    of elementary worker moves, walking along shortest paths between pushes.
+    '''
+    boxes = set(boxes)
+    elem_actions = []
+    for (bx, by), direction in pushes:
+        dx, dy = MOVES[direction]
+        elem_actions += get_walk_path(worker, (bx - dx, by - dy), walls, boxes)
+        elem_actions.append(direction)
+        boxes.remove((bx, by))
+        boxes.add((bx + dx, by + dy))
+        worker = (bx, by)
+    return elem_actions
+
+
+class SokobanBitboardPuzzle(search.Problem):
+    '''
+    Push-level weighted Sokoban puzzle with a compact bitboard state encoding.
+    Cell (x, y) is numbered y * stride + x, where stride = ncols + 1 leaves a
+    padding column so that shifting a row never wraps into interior cells.
+    A state is (worker_cell, box_mask, weight_ids): box_mask has one bit per
+    box, and weight_ids holds, in increasing cell order, the index of each
+    box weight in self.weight_table (empty when all boxes weigh the same).
+    Actions are pushes with the same costs as SokobanMacroPuzzle, coded as
+    the integer (walk * num_cells + box_cell) * 4 + d, d being the index of
+    the direction in PUSH_DIRECTIONS.
+    '''
+
+    def __init__(self, warehouse, analysis_dir=None):
+        '''
+        @param analysis_dir:
+            optional directory where the LevelAnalysis of the layout is
+            pickled (see get_level_analysis).
+        '''
+        self.warehouse = warehouse
+        self.walls = set(warehouse.walls)
+        self.stride = stride = warehouse.ncols + 1
+        self.offsets = {'Up': -stride, 'Down': stride, 'Left': -1, 'Right': 1}
+        self.weight_table = sorted(set(warehouse.weights))
+        self.uniform_weight = len(self.weight_table) == 1
+
+        analysis = get_level_analysis(warehouse, analysis_dir)
+        self.interior_mask = self.to_mask(analysis.open_cells)
+        self.target_mask = self.to_mask(warehouse.targets)
+        self.num_cells = self.interior_mask.bit_length()
+        self.taboo_mask = self.to_mask(analysis.taboo_set)
+        # Boxes and targets may also sit in pockets the worker cannot reach
+        self.min_target_distance = {self.cell(c): d
+                                    for c, d in zip(analysis.cells, analysis.min_push_distance)}
+
+        boxes = sorted(zip((self.cell(b) for b in warehouse.boxes), warehouse.weights))
+        box_mask = self.to_mask(warehouse.boxes)
+        weight_ids = () if self.uniform_weight else \
+            tuple(self.weight_table.index(w) for _, w in boxes)
+        self.initial = (self.cell(warehouse.worker), box_mask, weight_ids)
+
+    def cell(self, pos):
+        '''Return the cell number of the (x, y) position pos.'''
+        return pos[1] * self.stride + pos[0]
+
+    def position(self, cell):
+        '''Return the (x, y) position of a cell number.'''
+        return cell % self.stride, cell // self.stride
+
+    def to_mask(self, positions):
+        '''Return the bitmask of a collection of (x, y) positions.'''
+        mask = 0
+        for pos in positions:
+            mask |= 1 << self.cell(pos)
+        return mask
+
+    def box_weight(self, weight_ids, box_mask, cell):
+        '''Return the weight of the box on the given cell.'''
+        if self.uniform_weight:
+            return self.weight_table[0]
+        rank = (box_mask & ((1 << cell) - 1)).bit_count()
+        return self.weight_table[weight_ids[rank]]
+
+    def actions(self, state):
+        worker, boxes, weight_ids = state
+        free = self.interior_mask & ~boxes
+        layers = get_walk_layers(1 << worker, free, self.stride)
+        reachable = 0
+        for layer in layers:
+            reachable |= layer
+        open_cells = free & ~self.taboo_mask
+        legal_actions = []
+        for d, direction in enumerate(PUSH_DIRECTIONS):
+            s = self.offsets[direction]
+            # boxes with a reachable cell behind them and a free cell ahead
+            if s > 0:
+                pushable = boxes & (reachable << s) & (open_cells >> s)
+            else:
+                pushable = boxes & (reachable >> -s) & (open_cells << -s)
+            while pushable:
+                low = pushable & -pushable
+                pushable ^= low
+                box = low.bit_length() - 1
+                behind = 1 << (box - s)
+                walk = next(d for d, layer in enumerate(layers) if layer & behind)
+                legal_actions.append((walk * self.num_cells + box) * 4 + d)
+        return legal_actions
+
+    def decode_action(self, action):
+        '''Return the (box_cell, direction, walk) push coded by action.'''
+        rest, d = divmod(action, 4)
+        walk, box = divmod(rest, self.num_cells)
+        return box, PUSH_DIRECTIONS[d], walk
+
+    def result(self, state, action):
+        _, boxes, weight_ids = state
+        box, direction, _ = self.decode_action(action)
+        new_box = box + self.offsets[direction]
+        new_boxes = boxes & ~(1 << box) | (1 << new_box)
+        if weight_ids:
+            weight_ids = list(weight_ids)
+            wid = weight_ids.pop((boxes & ((1 << box) - 1)).bit_count())
+            weight_ids.insert((new_boxes & ((1 << new_box) - 1)).bit_count(), wid)
+            weight_ids = tuple(weight_ids)
+        return (box, new_boxes, weight_ids)
+
+    def goal_test(self, state):
+        return state[1] & ~self.target_mask == 0
+
+    def path_cost(self, c, state1, action, state2):
+        walk, box = divmod(action // 4, self.num_cells)
+        return c + walk + 1 + self.box_weight(state1[2], state1[1], box)
+
+    def h(self, node):
+        _, boxes, weight_ids = node.state
+        box_cost = 0
+        rank = 0
+        while boxes:
+            low = boxes & -boxes
+            boxes ^= low
+            weight = self.weight_table[weight_ids[rank]] if weight_ids else self.weight_table[0]
+            box_cost += self.min_target_distance[low.bit_length() - 1] * (1 + weight)
+            rank += 1
+        return box_cost
+
+    def expand_actions(self, macro_actions):
+        '''
+        Translate a sequence of push actions applied from the initial state
+        into the equivalent list of elementary worker moves.
+        '''
+        pushes = [(self.position(box), direction)
+                  for box, direction, _ in map(self.decode_action, macro_actions)]
+        return expand_pushes(self.warehouse.worker, self.warehouse.boxes, self.walls, pushes)
+
 
 # -----------------------------------------------------------------------------
 def check_elem_action_seq(warehouse, action_seq):
@@ -354,21 +1926,302 @@ def check_elem_action_seq(warehouse, action_seq):
     warehouse_copy.boxes = tuple(boxes)
     return str(warehouse_copy)
 
+def get_elem_action_cost(warehouse, action_seq):
+    '''
+    Return the cost of a legal sequence of elementary actions in the
+    warehouse: 1 per move, plus the weight of the box for a push.
+    '''
+    worker = warehouse.worker
+    weights = dict(zip(warehouse.boxes, warehouse.weights))
+    cost = 0
+    for action in action_seq:
+        dx, dy = MOVES[action]
+        worker = (worker[0] + dx, worker[1] + dy)
+        if worker in weights:
+            weight = weights.pop(worker)
+            weights[(worker[0] + dx, worker[1] + dy)] = weight
+            cost += weight
+        cost += 1
+    return cost
+
+# -----------------------------------------------------------------------------
+def make_puzzle(warehouse, mode, **options):
+    '''
+    Return the puzzle of the given mode ('elem', 'push' or 'bitboard', see
+    solve_weighted_sokoban) for the warehouse, built with options.
+    '''
+    if mode == 'push':
+        return SokobanMacroPuzzle(warehouse, **options)
+    if mode == 'bitboard':
+        return SokobanBitboardPuzzle(warehouse, **options)
+    if mode == 'elem':
+        return SokobanPuzzle(warehouse, **options)
+    raise ValueError(f"Unknown solver mode: {mode!r}")
+
+
+def keeps_optimality(options):
+    '''
+    Return False if the puzzle options give up optimality, whatever the
+    search algorithm: corral_pruning=True, macros or normalize.
+    '''
+    return not (options.get('corral_pruning') is True or options.get('macros') or
+                options.get('normalize'))
+
+
+def run_strategy(warehouse, mode='push', algorithm='astar', weight=2, bound=1, stats=None,
+                 time_methods=True, **options):
+    '''
+    Solve the weighted Sokoban puzzle with one search configuration.
+
+    @param mode:
+        puzzle formulation, see solve_weighted_sokoban.
+    @param algorithm:
+        'astar' (search.astar_graph_search), 'packed'
+        (search.packed_astar_search, storing the states packed into bytes;
+        not available in 'bitboard' mode), 'idastar' (search.idastar_search),
+        'weighted' (search.weighted_astar_search with the given weight) or
+        'arastar' (search.arastar_search starting from epsilon = weight, and
+        stopping at the first solution proven within bound times the
+        optimal cost). Ignored in 'bidirectional' mode.
+    @param stats:
+        optional search.SearchStats filled in with the counters of the
+        search (not collected by 'idastar' and 'weighted') and, if
+        time_methods is True, the time spent in each puzzle method (not
+        collected in 'bidirectional' mode). Timing the methods slows the
+        search down by about a fifth.
+    @param options:
+        keyword arguments passed on to the puzzle class of the mode.
+
+    Returns:
+      (solution_action_sequence, total_cost, proven_optimal), with
+      (['Impossible'], None, True) if the puzzle is unsolvable.
+      proven_optimal is False with corral_pruning=True, macros or
+      normalize, which may miss the optimal solution.
+    '''
+    if all((b[0], b[1]) in warehouse.targets for b in warehouse.boxes):
+        return [], 0, True
+
+    if mode == 'bidirectional':
+        result = search.bidirectional_uniform_cost_search(
+            SokobanPuzzle(warehouse, **options), SokobanPullPuzzle(warehouse, **options),
+            stats=stats)
+        if result is None:
+            return ['Impossible'], None, True
+        return result + (True,)
+    problem = make_puzzle(warehouse, mode, **options)
+    if stats is not None:
+        if time_methods:
+            problem = search.InstrumentedProblem(problem, stats)
+        start = time.perf_counter()
+    proven = True
+    if algorithm == 'astar':
+        result = search.astar_graph_search(problem, stats=stats)
+    elif algorithm == 'packed':
+        result = search.packed_astar_search(problem, stats=stats)
+    elif algorithm == 'idastar':
+        result = search.idastar_search(problem)
+    elif algorithm == 'weighted':
+        result, lower_bound = search.weighted_astar_search(problem, weight)
+        proven = result is None or result.path_cost <= lower_bound
+    elif algorithm == 'arastar':
+        result = None
+        for result, suboptimality in search.arastar_search(problem, weight, stats=stats):
+            if suboptimality <= bound:
+                break
+        proven = result is None or suboptimality <= 1
+    else:
+        raise ValueError(f"Unknown search algorithm: {algorithm!r}")
+    if not keeps_optimality(options):
+        proven = False
+    if stats is not None:
+        stats.seconds = time.perf_counter() - start
+        stats.peak_rss_kb = search.peak_rss_kb()
+
+    if result is None:
+        return ['Impossible'], None, True
+    if mode in ('push', 'bitboard'):
+        actions = problem.expand_actions(result.solution())
+        if options.get('normalize'):
+            # The search left the walks out of its costs
+            return actions, get_elem_action_cost(warehouse, actions), False
+        return actions, result.path_cost, proven
+    return result.solution(), result.path_cost, proven
+
 # -----------------------------------------------------------------------------
-def solve_weighted_sokoban(warehouse):
+
+# Strategies raced by solve_portfolio, as keyword arguments of run_strategy
+PORTFOLIO_STRATEGIES = (
+    {'mode': 'push'},
+    {'mode': 'push', 'algorithm': 'weighted', 'weight': 2},
+    {'mode': 'push', 'algorithm': 'weighted', 'weight': 5},
+    {'mode': 'push', 'heuristic': 'nearest'},
+    {'mode': 'push', 'algorithm': 'idastar'},
+    {'mode': 'bidirectional'},
+)
+
+
+def _run_portfolio_strategy(warehouse, strategy, results):
+    try:
+        results.put((strategy,) + run_strategy(warehouse, **strategy) + (None,))
+    except Exception:
+        results.put((strategy, None, None, False, traceback.format_exc()))
+
+
+def solve_portfolio(warehouse, strategies=PORTFOLIO_STRATEGIES, optimal=True):
+    '''
+    Race several strategies on the warehouse, each in its own process, and
+    return the first acceptable result, terminating the other processes.
+    When optimal is True, a result is only acceptable if its strategy has
+    proven it optimal (a bounded-suboptimal weighted A* solution is proven
+    optimal when its cost reaches the lower bound of the search). If no
+    result is acceptable, the cheapest solution found is returned.
+    A strategy raising an exception is logged with its traceback, and if
+    every strategy does, a RuntimeError carrying their tracebacks is
+    raised.
+
+    @param strategies:
+        sequence of dicts of keyword arguments of run_strategy.
+
+    Returns the same as solve_weighted_sokoban.
+    '''
+    results = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=_run_portfolio_strategy,
+                                         args=(warehouse, strategy, results), daemon=True)
+                 for strategy in strategies]
+    for process in processes:
+        process.start()
+    best = None
+    errors = []
+    pending = len(processes)
+    try:
+        while pending:
+            try:
+                strategy, solution, cost, proven, error = results.get(timeout=1)
+            except queue.Empty:
+                if not any(process.is_alive() for process in processes):
+                    break  # some strategies died without a result
+                continue
+            pending -= 1
+            if error is not None:
+                logger.warning("Portfolio strategy %r failed:\n%s", strategy, error)
+                errors.append(f"Strategy {strategy!r}:\n{error}")
+                continue
+            if proven or not optimal:
+                return solution, cost
+            if cost is not None and (best is None or cost < best[1]):
+                best = (solution, cost)
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join()
+    if best is None:
+        if len(errors) == len(processes):
+            raise RuntimeError("Every strategy of the portfolio raised an exception\n"
+                               + "\n".join(errors))
+        raise RuntimeError("Every strategy of the portfolio failed")
+    return best
+
+
+def solve_weighted_sokoban(warehouse, mode='elem', cache=None, return_stats=False, **options):
     '''
     Solve the weighted Sokoban puzzle for the given warehouse.
+
+    @param mode:
+        'elem' searches over elementary worker moves (SokobanPuzzle),
+        'push' searches over box pushes (SokobanMacroPuzzle) and expands
+        the solution back into elementary moves,
+        'bitboard' is the push-level search on bitboard states
+        (SokobanBitboardPuzzle), 'bidirectional' meets a forward search
+        over elementary moves with a backward search over pulls from the
+        goal states (SokobanPullPuzzle). With the default A* search, all
+        these modes are optimal.
+        'portfolio' races several of them in parallel (solve_portfolio).
+    @param options:
+        keyword arguments passed on to run_strategy, that is the search
+        algorithm or the puzzle class options, for instance
+        heuristic='nearest', corral_pruning=True, macros=True or normalize=True (push mode),
+        algorithm='idastar', or algorithm='arastar' with a target
+        suboptimality bound=1.5, or analysis_dir to keep the static
+        analysis of the layout on disk (see get_level_analysis);
+        in 'portfolio' mode, the arguments of solve_portfolio.
+    @param cache:
+        optional SolutionCache (or path of its database) consulted before
+        searching. Solutions proven optimal are added to it; portfolio
+        results are not.
+    @param return_stats:
+        if True, a search.SearchStats of the run is returned as a third
+        element (left empty for cached and portfolio results).
     
     Returns:
       If unsolvable: ('Impossible', None)
       Otherwise: (solution_action_sequence, total_cost)
     '''
+    stats = search.SearchStats() if return_stats else None
+    if isinstance(cache, str):
+        cache = SolutionCache(cache)
+    if cache is not None:
+        cached = cache.get(warehouse)
+        if cached is not None:
+            return cached + (stats,) if return_stats else cached
+    if mode == 'portfolio':
+        solution, cost = solve_portfolio(warehouse, **options)
+    else:
+        solution, cost, proven = run_strategy(warehouse, mode, stats=stats, **options)
+        if cache is not None and proven:
+            cache.put(warehouse, solution, cost)
+    if return_stats:
+        return solution, cost, stats
+    return solution, cost
+
+
+class SolveResult:
+    '''
+    Outcome of solve_within_budget.
+    status is one of search.SearchResult.SOLVED, IMPOSSIBLE or EXHAUSTED;
+    solution and cost describe the solution found when solved, the best
+    solution found so far when the budget ran out (None if there is none),
+    and stats is the search.SearchStats of the run.
+    optimal is True if the solution is proven optimal: the search finished
+    and no puzzle option gave up optimality (see keeps_optimality).
+    '''
+
+    def __init__(self, status, solution, cost, stats, optimal=False):
+        self.status = status
+        self.solution = solution
+        self.cost = cost
+        self.stats = stats
+        self.optimal = optimal
+
+    def __repr__(self):
+        return f"<SolveResult {self.status} cost={self.cost} optimal={self.optimal}>"
+
+
+def solve_within_budget(warehouse, budget, mode='push', **options):
+    '''
+    Solve the weighted Sokoban puzzle with A* under a search.SearchBudget
+    of nodes, seconds and memory, and return a SolveResult instead of
+    running for as long as the search takes.
+
+    @param mode:
+        'elem', 'push' or 'bitboard', see solve_weighted_sokoban.
+    @param options:
+        keyword arguments passed on to the puzzle class of the mode. With
+        normalize=True, the search leaves the walks out of its costs: the
+        cost returned is that of the expanded plan, walks included, and is
+        not optimal (the result has optimal=False).
+    '''
     if all((b[0], b[1]) in warehouse.targets for b in warehouse.boxes):
-        return [], 0
-    
-    problem = SokobanPuzzle(warehouse)
-    result = search.astar_graph_search(problem)
-    
-    if result is None:
-        return ['Impossible'], None
-    return result.solution(), result.path_cost
+        return SolveResult(search.SearchResult.SOLVED, [], 0, search.SearchStats(), True)
+    problem = make_puzzle(warehouse, mode, **options)
+    result = search.budgeted_astar_search(problem, budget)
+    if result.node is None:
+        return SolveResult(result.status, None, None, result.stats)
+    solution = result.node.solution()
+    cost = result.node.path_cost
+    if mode in ('push', 'bitboard'):
+        solution = problem.expand_actions(solution)
+        if options.get('normalize'):
+            cost = get_elem_action_cost(warehouse, solution)
+    optimal = result.status == search.SearchResult.SOLVED and keeps_optimality(options)
+    return SolveResult(result.status, solution, cost, result.stats, optimal)
@@ -32,6 +32,8 @@ assert sys.version_info >= (3, 5)
 import itertools
 import functools
 import heapq
+import time
+from array import array
 
 import collections # for dequeue
 
@@ -164,6 +166,78 @@ class PriorityQueue:
         heapq.heapify(self.heap)
 
 
+class IndexedPriorityQueue:
+    """A PriorityQueue with O(1) membership test, lookup and deletion.
+    Items are indexed in a dict by themselves (for search nodes, by their
+    state), and the heap uses lazy deletion: a deleted or replaced entry stays
+    in the heap and is skipped when it reaches the top.
+    Pops items in the same order as PriorityQueue."""
+
+    def __init__(self, order='min', f=lambda x: x):
+        self.heap = []
+        self.entries = {}  # item -> (f(item), item) entry currently live
+        if order == 'min':
+            self.f = f
+        elif order == 'max':  # now item with max f(x)
+            self.f = lambda x: -f(x)  # will be popped first
+        else:
+            raise ValueError("Order must be either 'min' or 'max'.")
+
+    def append(self, item):
+        """Insert item at its correct position, replacing any equal item."""
+        entry = (self.f(item), item)
+        self.entries.pop(item, None)
+        self.entries[item] = entry
+        heapq.heappush(self.heap, entry)
+
+    def extend(self, items):
+        """Insert each item in items at its correct position."""
+        for item in items:
+            self.append(item)
+
+    def pop(self):
+        """Pop and return the item (with min or max f(x) value)
+        depending on the order."""
+        while self.heap:
+            entry = heapq.heappop(self.heap)
+            item = entry[1]
+            if self.entries.get(item) is entry:
+                del self.entries[item]
+                return item
+        raise Exception('Trying to pop from empty PriorityQueue.')
+
+    def __len__(self):
+        """Return the number of live items in the queue."""
+        return len(self.entries)
+
+    def __contains__(self, key):
+        """Return True if the key is in the queue."""
+        return key in self.entries
+
+    def __iter__(self):
+        """Iterate over the items in the queue, in no particular order."""
+        return iter(self.entries)
+
+    def __getitem__(self, key):
+        """Returns the value associated with key in the queue.
+        Raises KeyError if key is not present."""
+        try:
+            return self.entries[key][0]
+        except KeyError:
+            raise KeyError(str(key) + " is not in the priority queue")
+
+    def __delitem__(self, key):
+        """Delete key. Its heap entry is discarded lazily."""
+        try:
+            del self.entries[key]
+        except KeyError:
+            raise KeyError(str(key) + " is not in the priority queue")
+        # Rebuild the heap once stale entries dominate it
+        if len(self.heap) > 2 * len(self.entries) + 1024:
+            self.heap = list(self.entries.values())
+            heapq.heapify(self.heap)
+
+
 #______________________________________________________________________________
 
 class Problem(object):
@@ -219,12 +293,15 @@ class Node:
     that this is a successor of) and to the actual state for this node. Note
     that if a state is arrived at by two paths, then there are two nodes with
     the same state.  Also includes the action that got us to this state, and
-    the total path_cost (also known as g) to reach the node.  Other functions
-    may add an f and h value; see best_first_graph_search and astar_search for
-    an explanation of how the f and h values are handled. You will not need to
-    subclass this class.
+    the total path_cost (also known as g) to reach the node.  The h and f
+    slots are left unset until a search stores the heuristic and priority
+    of the node there; see astar_graph_search. Nodes use __slots__ to keep
+    large frontiers small, so no other attribute can be added. You will not
+    need to subclass this class.
     """
 
+    __slots__ = ('state', 'parent', 'action', 'path_cost', 'depth', 'h', 'f')
+
     def __init__(self, state, parent=None, action=None, path_cost=0):
         """Create a search tree Node, derived from a parent by an action."""
         self.state = state
@@ -287,6 +364,137 @@ class Node:
         # with the same state in a Hash Table        
         return hash(self.state)
 
+#______________________________________________________________________________
+# Search budgets and results
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+
+def peak_rss_kb():
+    """Return the peak resident set size of the process in kilobytes,
+    or None where the platform does not report it."""
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class SearchStats:
+    """Counters of a search run: expanded and generated nodes, generated
+    nodes whose state was already known (duplicates), generated nodes
+    dropped because their f value is infinite (pruned) and closed states
+    put back on the frontier (reopened), peak frontier and explored set sizes,
+    elapsed wall-clock seconds and peak resident set size (kB) of the
+    process. timings holds the seconds spent in each Problem method when
+    the problem is wrapped in an InstrumentedProblem."""
+
+    def __init__(self):
+        self.expanded = 0
+        self.generated = 0
+        self.duplicates = 0
+        self.pruned = 0
+        self.reopened = 0
+        self.peak_frontier = 0
+        self.peak_explored = 0
+        self.seconds = 0.0
+        self.peak_rss_kb = None
+        self.timings = {}
+
+    def __repr__(self):
+        return "<SearchStats {}>".format(vars(self))
+
+
+class InstrumentedProblem(Problem):
+    """Wrap problem to time its methods actions, result, path_cost,
+    goal_test and h, adding the seconds spent in each to stats.timings.
+    Any other attribute is looked up on the wrapped problem. Unwrapped
+    problems are not timed, so instrumentation costs nothing when unused."""
+
+    def __init__(self, problem, stats):
+        self.problem = problem
+        self.stats = stats
+        self.initial = problem.initial
+
+    def __getattr__(self, name):
+        return getattr(self.problem, name)
+
+    def _timed(self, name, *args):
+        start = time.perf_counter()
+        value = getattr(self.problem, name)(*args)
+        timings = self.stats.timings
+        timings[name] = timings.get(name, 0.0) + time.perf_counter() - start
+        return value
+
+    def actions(self, state):
+        return self._timed('actions', state)
+
+    def result(self, state, action):
+        return self._timed('result', state, action)
+
+    def goal_test(self, state):
+        return self._timed('goal_test', state)
+
+    def path_cost(self, c, state1, action, state2):
+        return self._timed('path_cost', c, state1, action, state2)
+
+    def h(self, node):
+        return self._timed('h', node)
+
+
+class SearchBudget:
+    """Limits on a search, checked cooperatively by the search loop:
+    max_nodes expanded nodes, max_seconds of wall-clock time and
+    max_memory_mb of peak resident set size. A limit of None is no limit.
+    Time and memory are only read every check_every expansions."""
+
+    def __init__(self, max_nodes=None, max_seconds=None, max_memory_mb=None,
+                 check_every=256):
+        self.max_nodes = max_nodes
+        self.max_seconds = max_seconds
+        self.max_memory_mb = max_memory_mb
+        self.check_every = check_every
+
+    def start(self):
+        """Start the clock of the budget."""
+        self.start_time = time.perf_counter()
+
+    def exhausted(self, stats):
+        """Return True if the search described by stats is out of budget."""
+        if self.max_nodes is not None and stats.expanded >= self.max_nodes:
+            return True
+        if stats.expanded % self.check_every:
+            return False
+        if self.max_seconds is not None and \
+                time.perf_counter() - self.start_time >= self.max_seconds:
+            return True
+        if self.max_memory_mb is not None:
+            rss = peak_rss_kb()
+            if rss is not None and rss >= self.max_memory_mb * 1024:
+                return True
+        return False
+
+
+class SearchResult:
+    """Outcome of a search run under a budget.
+    status is SOLVED, IMPOSSIBLE (the search space was exhausted without
+    reaching a goal) or EXHAUSTED (the budget ran out). node is the goal
+    node found, or for EXHAUSTED the cheapest goal node generated so far,
+    if any; stats is the SearchStats of the run."""
+
+    SOLVED = 'solved'
+    IMPOSSIBLE = 'impossible'
+    EXHAUSTED = 'budget exhausted'
+
+    def __init__(self, status, node, stats):
+        self.status = status
+        self.node = node
+        self.stats = stats
+
+    def __repr__(self):
+        return "<SearchResult {} {}>".format(self.status, self.node)
+
 #______________________________________________________________________________
 
 # Uninformed Search algorithms
@@ -310,27 +518,35 @@ def tree_search(problem, frontier):
     return None
 
 
-def graph_search(problem, frontier):
+def graph_search(problem, frontier, stats=None):
     """
     Search through the successors of a problem to find a goal.
     The argument frontier should be an empty queue.
     If two paths reach a state, only use the first one. [Fig. 3.7]
+    The optional SearchStats stats is updated with the search counters.
     Return
         the node of the first goal state found
         or None is no goal state is found
     """
     assert isinstance(problem, Problem)
+    if stats is None:
+        stats = SearchStats()
     frontier.append(Node(problem.initial))
     explored = set() # initial empty set of explored states
     while frontier:
+        stats.peak_frontier = max(stats.peak_frontier, len(frontier))
         node = frontier.pop()
         if problem.goal_test(node.state):
             return node
         explored.add(node.state)
-        # Python note: next line uses of a generator
-        frontier.extend(child for child in node.expand(problem)
-                        if child.state not in explored
-                        and child not in frontier)
+        stats.expanded += 1
+        stats.peak_explored = len(explored)
+        for child in node.expand(problem):
+            stats.generated += 1
+            if child.state not in explored and child not in frontier:
+                frontier.append(child)
+            else:
+                stats.duplicates += 1
     return None
 
 
@@ -390,35 +606,100 @@ def best_first_tree_search(problem, f):
 
 
 
-def best_first_graph_search(problem, f):
+def best_first_graph_search(problem, f, frontier=None, stats=None, on_expand=None, closed=None):
     """
     Search the nodes with the lowest f scores first.
     You specify the function f(node) that you want to minimize; for example,
     if f is a heuristic estimate to the goal, then we have greedy best
     first search; if f is node.depth then we have breadth-first search.
+    The optional argument frontier is an empty priority queue ordered by f;
+    it defaults to an IndexedPriorityQueue.
+    Nodes with an infinite f value, such as the nodes an admissible
+    heuristic proves cannot reach a goal, are never put on the frontier.
+    The closed set is a set of states, unless closed is 'packed': it is
+    then a StateStore of the records problem.pack(state) (see
+    packed_astar_search), so that expanded states can be freed once no
+    frontier node descends from them, at the cost of packing every state
+    looked up.
+    The optional SearchStats stats is filled in with the search counters,
+    and on_expand(node) is called before each node is expanded.
+    """
+    return budgeted_best_first_graph_search(problem, f, frontier=frontier, stats=stats,
+                                            on_expand=on_expand, closed=closed).node
+
+
+def budgeted_best_first_graph_search(problem, f, budget=None, frontier=None,
+                                     stats=None, on_expand=None, closed=None):
+    """
+    best_first_graph_search under an optional SearchBudget.
+    Return a SearchResult. When the budget runs out, its node is the
+    cheapest goal node generated so far, if any.
     """
+    if stats is None:
+        stats = SearchStats()
+    start = time.perf_counter()
+    if budget is not None:
+        budget.start()
+    result = _best_first_graph_search(problem, f, frontier, budget, stats, on_expand, closed)
+    stats.seconds = time.perf_counter() - start
+    stats.peak_rss_kb = peak_rss_kb()
+    return result
+
+
+def _best_first_graph_search(problem, f, frontier, budget, stats, on_expand, closed):
+    if closed not in (None, 'packed'):
+        raise ValueError(f"Unknown closed set: {closed!r}")
     node = Node(problem.initial)
     if problem.goal_test(node.state):
-        return node
-    frontier = PriorityQueue(f=f)
+        return SearchResult(SearchResult.SOLVED, node, stats)
+    if f(node) == float('inf'):
+        stats.pruned += 1
+        return SearchResult(SearchResult.IMPOSSIBLE, None, stats)
+    if frontier is None:
+        frontier = IndexedPriorityQueue(f=f)
     frontier.append(node)
-    explored = set() # set of states
+    if closed == 'packed':
+        explored, pack = StateStore(problem.record_size, 2**10), problem.pack
+    else:
+        explored, pack = set(), None # set of states
+    incumbent = None # cheapest goal node generated, when under a budget
     while frontier:
+        if budget is not None and budget.exhausted(stats):
+            stats.peak_explored = len(explored)
+            return SearchResult(SearchResult.EXHAUSTED, incumbent, stats)
+        if len(frontier) > stats.peak_frontier:
+            stats.peak_frontier = len(frontier)
         node = frontier.pop()
         if problem.goal_test(node.state):
-            return node
-        explored.add(node.state)
+            stats.peak_explored = len(explored)
+            return SearchResult(SearchResult.SOLVED, node, stats)
+        explored.add(node.state if pack is None else pack(node.state))
+        stats.expanded += 1
+        if on_expand is not None:
+            on_expand(node)
         for child in node.expand(problem):
-            if child.state not in explored and child not in frontier:
+            stats.generated += 1
+            if child not in frontier and \
+                    (child.state if pack is None else pack(child.state)) not in explored:
+                if f(child) == float('inf'):
+                    stats.pruned += 1
+                    continue
                 frontier.append(child)
             elif child in frontier:
+                stats.duplicates += 1
                 # frontier[child] is the f value of the 
                 # incumbent node that shares the same state as 
-                # the node child.  Read implementation of PriorityQueue
+                # the node child.  Read implementation of IndexedPriorityQueue
                 if f(child) < frontier[child]:
                     del frontier[child] # delete the incumbent node
                     frontier.append(child) # 
-    return None
+            else:
+                stats.duplicates += 1
+            if budget is not None and problem.goal_test(child.state) and \
+                    (incumbent is None or child.path_cost < incumbent.path_cost):
+                incumbent = child
+    stats.peak_explored = len(explored)
+    return SearchResult(SearchResult.IMPOSSIBLE, None, stats)
 
 
 def uniform_cost_search(problem):
@@ -463,12 +744,22 @@ def iterative_deepening_search(problem):
 greedy_best_first_graph_search = best_first_graph_search
 # Greedy best-first search is accomplished by specifying f(n) = h(n).
 
-def astar_graph_search(problem, h=None):
+def astar_graph_search(problem, h=None, stats=None, on_expand=None, closed=None):
     """A* search is best-first graph search with f(n) = g(n)+h(n).
     You need to specify the h function when you call astar_search, or
-    else in your Problem subclass."""
+    else in your Problem subclass.
+    stats, on_expand and closed are passed on to best_first_graph_search."""
     h = memoize(h or problem.h, slot='h')
-    return best_first_graph_search(problem, lambda n: n.path_cost + h(n))
+    f = memoize(lambda n: n.path_cost + h(n), slot='f')
+    return best_first_graph_search(problem, f, stats=stats, on_expand=on_expand, closed=closed)
+
+
+def budgeted_astar_search(problem, budget=None, h=None, stats=None, closed=None):
+    """astar_graph_search under an optional SearchBudget.
+    Return a SearchResult, see budgeted_best_first_graph_search."""
+    h = memoize(h or problem.h, slot='h')
+    f = memoize(lambda n: n.path_cost + h(n), slot='f')
+    return budgeted_best_first_graph_search(problem, f, budget, stats=stats, closed=closed)
 
 
 def astar_tree_search(problem, h=None):
@@ -478,6 +769,409 @@ def astar_tree_search(problem, h=None):
     h = memoize(h or problem.h, slot='h')
     return best_first_tree_search(problem, lambda n: n.path_cost + h(n))
 
+
+def weighted_astar_search(problem, weight=2, h=None):
+    """Weighted A* search: best-first graph search with f(n) = g(n) + weight*h(n).
+    If h is admissible, the solution costs at most weight times the optimum.
+    Closed states reached again more cheaply are not reopened but recorded
+    in an INCONS set [Likhachev, Gordon and Thrun 2003], so that the lowest
+    g + h over the frontier and INCONS nodes is a lower bound on the optimal
+    cost. Return (node, lower_bound); the solution is proven optimal when
+    node.path_cost <= lower_bound. Return (None, inf) if there is no solution."""
+    h = memoize(h or problem.h, slot='h')
+    node = Node(problem.initial)
+    if h(node) == float('inf'):
+        return None, float('inf')
+    frontier = IndexedPriorityQueue(f=memoize(lambda n: n.path_cost + weight * h(n), slot='f'))
+    frontier.append(node)
+    best_g = {node.state: 0}
+    explored = set()
+    incons = {}  # closed state -> cheaper node found after its expansion
+    while frontier:
+        node = frontier.pop()
+        if problem.goal_test(node.state):
+            lower_bound = min([n.path_cost + h(n) for n in frontier] +
+                              [n.path_cost + h(n) for n in incons.values()] +
+                              [node.path_cost])
+            return node, lower_bound
+        explored.add(node.state)
+        for child in node.expand(problem):
+            if child.path_cost >= best_g.get(child.state, float('inf')) or \
+                    h(child) == float('inf'):
+                continue
+            best_g[child.state] = child.path_cost
+            if child.state in explored:
+                incons[child.state] = child
+            else:
+                frontier.append(child)  # replaces the incumbent, if any
+    return None, float('inf')
+
+
+def arastar_search(problem, epsilon=3, decrement=0.5, h=None, budget=None, stats=None):
+    """Anytime Repairing A* [Likhachev, Gordon and Thrun 2003].
+    A generator of solutions of decreasing cost. Weighted A* searches are
+    run with f(n) = g(n) + epsilon*h(n), epsilon being lowered by decrement
+    (down to 1) after each solution. Every search reuses the g values and
+    frontier of the previous one: closed states improved after their
+    expansion are kept in an INCONS set and put back on the frontier,
+    so that only the inconsistent part of the search is repaired.
+    Yields (node, bound) with node.path_cost <= bound * optimal cost, bound
+    being at most epsilon; the last solution yielded has bound 1 unless
+    the optional SearchBudget runs out. Yields nothing if there is no
+    solution. The optional SearchStats stats is updated as the search goes."""
+    h = memoize(h or problem.h, slot='h')
+    weight = epsilon
+    # not stored in the f slot: the priorities change with the weight
+    f = lambda n: n.path_cost + weight * h(n)
+    if stats is None:
+        stats = SearchStats()
+    if budget is not None:
+        budget.start()
+    root = Node(problem.initial)
+    if h(root) == float('inf'):
+        return
+    best = {root.state: root}  # state -> cheapest node found
+    goal = root if problem.goal_test(root.state) else None
+    frontier = IndexedPriorityQueue(f=f)
+    frontier.append(root)
+    last_goal, last_bound = None, None  # last solution yielded
+    while True:
+        explored = set()
+        incons = {}
+        # Search until no frontier node can lead to a cheaper goal
+        while frontier:
+            if budget is not None and budget.exhausted(stats):
+                return
+            stats.peak_frontier = max(stats.peak_frontier, len(frontier))
+            node = frontier.pop()
+            if goal is not None and goal.path_cost <= f(node):
+                frontier.append(node)
+                break
+            explored.add(node.state)
+            stats.expanded += 1
+            for child in node.expand(problem):
+                stats.generated += 1
+                incumbent = best.get(child.state)
+                if incumbent is not None:
+                    stats.duplicates += 1
+                    if incumbent.path_cost <= child.path_cost:
+                        continue
+                elif h(child) == float('inf'):
+                    stats.pruned += 1
+                    continue
+                best[child.state] = child
+                if problem.goal_test(child.state) and \
+                        (goal is None or child.path_cost < goal.path_cost):
+                    goal = child
+                if child.state in explored:
+                    incons[child.state] = child
+                else:
+                    frontier.append(child)
+        if goal is None:
+            return
+        pending = list(frontier) + list(incons.values())
+        lower_bound = min((n.path_cost + h(n) for n in pending), default=float('inf'))
+        if goal.path_cost <= lower_bound:
+            yield goal, 1
+            return
+        bound = min(weight, goal.path_cost / lower_bound) if lower_bound > 0 else weight
+        if goal is not last_goal or bound < last_bound:
+            yield goal, bound
+            last_goal, last_bound = goal, bound
+        weight = max(1, weight - decrement)
+        stats.reopened += len(incons)
+        frontier = IndexedPriorityQueue(f=f)
+        frontier.extend(pending)
+
+
+class TranspositionTable:
+    """Fixed-size hash table remembering, for the states visited by an
+    iterative deepening search, the lowest path cost they were reached with
+    and the iteration that reached them. Each state hashes to a single slot.
+    When two states collide, the incumbent is kept if it was stored during
+    the current iteration with a smaller path cost (its subtree is larger
+    and more expensive to search again), otherwise it is replaced."""
+
+    def __init__(self, size=2**20):
+        self.size = size
+        self.slots = [None] * size  # (state, path cost, iteration)
+
+    def visit(self, state, g, iteration):
+        """Record that state is reached with path cost g during iteration.
+        Return False if the state is already known to be reached at most
+        as cheaply, in which case its subtree need not be searched again."""
+        i = hash(state) % self.size
+        entry = self.slots[i]
+        if entry is not None and entry[0] == state:
+            if entry[1] < g or (entry[1] == g and entry[2] == iteration):
+                return False
+        elif entry is not None and entry[2] == iteration and entry[1] < g:
+            return True
+        self.slots[i] = (state, g, iteration)
+        return True
+
+
+def idastar_search(problem, h=None, table_size=2**20):
+    """Iterative deepening A* search [Korf 1985].
+    Repeated depth-first searches bounded by an f = g + h threshold, which
+    starts at h(root) and is raised to the smallest f value that exceeded it.
+    The memory used is that of the current path plus a TranspositionTable
+    of table_size slots, which prunes cycles and states already reached
+    at a lower or equal cost. Children are tried in order of increasing f.
+    Step costs must be positive. The solution is optimal if h is admissible."""
+    h = memoize(h or problem.h, slot='h')
+    f = memoize(lambda n: n.path_cost + h(n), slot='f')
+    root = Node(problem.initial)
+    table = TranspositionTable(table_size)
+    threshold = f(root)
+    if threshold == float('inf'):
+        return None
+    for iteration in itertools.count():
+        next_threshold = float('inf')
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            if f(node) > threshold:
+                next_threshold = min(next_threshold, f(node))
+                continue
+            if problem.goal_test(node.state):
+                return node
+            if not table.visit(node.state, node.path_cost, iteration):
+                continue
+            # the child with the lowest f value is popped first
+            stack.extend(sorted(node.expand(problem), key=f, reverse=True))
+        if next_threshold == float('inf'):
+            return None
+        threshold = next_threshold
+
+
+class StateStore:
+    """Set of states packed as fixed-width records of record_size bytes.
+    Records are kept back to back in a bytearray and numbered in insertion
+    order; an open-addressing hash table (linear probing) over an array of
+    record numbers finds them again. Both are preallocated for capacity
+    records and doubled when full, the table being kept at most half full.
+    A search can then refer to a state by its number alone."""
+
+    def __init__(self, record_size, capacity=2**16):
+        self.record_size = record_size
+        self.records = bytearray(record_size * capacity)
+        self.count = 0
+        self.slots = array('i', [-1]) * (2 * capacity)
+        self.mask = 2 * capacity - 1
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        """Return the record numbered index."""
+        if not 0 <= index < self.count:
+            raise IndexError(index)
+        start = index * self.record_size
+        return bytes(self.records[start:start + self.record_size])
+
+    def _probe(self, record):
+        """Return the slot holding record, or the empty slot where it goes."""
+        size, records, slots, mask = self.record_size, self.records, self.slots, self.mask
+        i = hash(record) & mask
+        while slots[i] >= 0:
+            if records.startswith(record, slots[i] * size):
+                return i
+            i = (i + 1) & mask
+        return i
+
+    def __contains__(self, record):
+        return self.slots[self._probe(record)] >= 0
+
+    def find(self, record):
+        """Return the number of record, or -1 if it is not in the store."""
+        return self.slots[self._probe(record)]
+
+    def add(self, record):
+        """Return (number of record, True if it has just been added)."""
+        if len(record) != self.record_size:
+            raise ValueError("Expected a record of {} bytes".format(self.record_size))
+        i = self._probe(record)
+        if self.slots[i] >= 0:
+            return self.slots[i], False
+        index = self.count
+        start = index * self.record_size
+        if start == len(self.records):
+            self.records *= 2  # in place; the copied records are overwritten
+        self.records[start:start + self.record_size] = record
+        self.slots[i] = index
+        self.count += 1
+        if 2 * self.count > self.mask:
+            self._grow()
+        return index, True
+
+    def _grow(self):
+        """Double the hash table and insert every record again."""
+        self.slots = array('i', [-1]) * (2 * len(self.slots))
+        self.mask = len(self.slots) - 1
+        for index in range(self.count):
+            self.slots[self._probe(self[index])] = index
+
+
+def packed_astar_search(problem, h=None, stats=None, capacity=2**10):
+    """A* graph search keeping every state packed in a StateStore.
+    The problem must provide pack(state), returning a bytes record of
+    problem.record_size bytes, and its inverse unpack(record). States are
+    unpacked only to be expanded; the closed set, path costs and parent
+    links are arrays indexed by state number, and the frontier is a heap
+    of the distinct f values, each with an array of the state numbers
+    queued with it, stale entries being skipped when popped. A state thus
+    takes a few dozen bytes. Neither actions nor h values are stored: h is
+    computed again when a cheaper path to a queued state is found, and the
+    path to the goal is rebuilt at the end by expanding each state on it
+    and keeping the cheapest child that packs to the next one. Ties on f
+    are broken in favour of the state queued last, so the solution may
+    differ from astar_graph_search's, at the same cost. States with an
+    infinite h value are never expanded.
+    Return the goal Node, or None. The optional SearchStats stats is
+    filled in with the search counters."""
+    h = h or problem.h
+    if stats is None:
+        stats = SearchStats()
+    start = time.perf_counter()
+    store = StateStore(problem.record_size, capacity)
+    store.add(problem.pack(problem.initial))
+    g = array('d', [0])
+    parents = array('i', [-1])
+    closed = bytearray(1)
+    f_values = []  # heap of the f values with queued states
+    buckets = {}  # f value -> array of the state numbers queued with it
+    queued = 0
+
+    def push(f, index):
+        bucket = buckets.get(f)
+        if bucket is None:
+            bucket = buckets[f] = array('i')
+            heapq.heappush(f_values, f)
+        bucket.append(index)
+
+    f = h(Node(problem.initial))
+    if f < float('inf'):
+        push(f, 0)
+        queued = 1
+    goal = None
+    while f_values:
+        stats.peak_frontier = max(stats.peak_frontier, queued)
+        bucket = buckets[f_values[0]]
+        index = bucket.pop()
+        queued -= 1
+        if not bucket:
+            del buckets[heapq.heappop(f_values)]
+        if closed[index]:
+            continue
+        state = problem.unpack(store[index])
+        if problem.goal_test(state):
+            goal = index
+            break
+        closed[index] = 1
+        stats.expanded += 1
+        node = Node(state, None, None, g[index])  # parent of the nodes passed to h
+        for action in problem.actions(state):
+            stats.generated += 1
+            child = problem.result(state, action)
+            cost = problem.path_cost(g[index], state, action, child)
+            child_index, added = store.add(problem.pack(child))
+            if added:
+                g.append(cost)
+                parents.append(index)
+                closed.append(0)
+            else:
+                stats.duplicates += 1
+                if closed[child_index] or cost >= g[child_index]:
+                    continue
+                g[child_index] = cost
+                parents[child_index] = index
+            f = cost + h(Node(child, node, action, cost))
+            if f == float('inf'):
+                # a state h proves to be a dead end is closed right away
+                closed[child_index] = 1
+                stats.pruned += 1
+                continue
+            push(f, child_index)
+            queued += 1
+    stats.peak_explored = len(store)
+    stats.seconds = time.perf_counter() - start
+    stats.peak_rss_kb = peak_rss_kb()
+    if goal is None:
+        return None
+    path = [goal]
+    while parents[path[-1]] >= 0:
+        path.append(parents[path[-1]])
+    node = Node(problem.initial)
+    for index in reversed(path[:-1]):
+        record = store[index]
+        node = min((child for child in node.expand(problem)
+                    if problem.pack(child.state) == record),
+                   key=lambda child: child.path_cost)
+    return node
+
+
+def bidirectional_uniform_cost_search(problem, reverse_problem, stats=None):
+    """Bidirectional uniform cost search.
+    A forward search from problem.initial and a backward search from the
+    goal states run alternately, the side with the smaller frontier being
+    expanded, until the lowest path costs of the two frontiers add up to
+    at least the cost of the best path found through a state reached from
+    both sides.
+    reverse_problem describes the moves backwards: its attribute initials
+    lists the goal states, result(s, a) is a state from which problem
+    reaches s, path_cost is the cost of that forward move, and
+    forward_action(a) is the forward action undone by a. The two problems
+    must produce equal (and equally hashed) states.
+    Return (actions, cost) for an optimal solution, or None. The optional
+    SearchStats stats is filled in with the search counters of both sides."""
+    if stats is None:
+        stats = SearchStats()
+    start = time.perf_counter()
+    problems = (problem, reverse_problem)
+    root = Node(problem.initial)
+    reached = ({root.state: root}, {})  # state -> best node, per side
+    frontiers = ([(0, root)], [])
+    for state in reverse_problem.initials:
+        node = Node(state)
+        reached[1][state] = node
+        frontiers[1].append((0, node))
+    heapq.heapify(frontiers[1])
+    best, meeting = float('inf'), None
+    if root.state in reached[1]:
+        best, meeting = 0, (root, reached[1][root.state])
+    while frontiers[0] and frontiers[1]:
+        if frontiers[0][0][0] + frontiers[1][0][0] >= best:
+            break
+        stats.peak_frontier = max(stats.peak_frontier, len(frontiers[0]) + len(frontiers[1]))
+        side = 0 if len(frontiers[0]) <= len(frontiers[1]) else 1
+        _, node = heapq.heappop(frontiers[side])
+        if reached[side][node.state] is not node:
+            continue  # superseded by a cheaper node
+        stats.expanded += 1
+        for child in node.expand(problems[side]):
+            stats.generated += 1
+            incumbent = reached[side].get(child.state)
+            if incumbent is not None:
+                stats.duplicates += 1
+                if incumbent.path_cost <= child.path_cost:
+                    continue
+            reached[side][child.state] = child
+            heapq.heappush(frontiers[side], (child.path_cost, child))
+            other = reached[1 - side].get(child.state)
+            if other is not None and child.path_cost + other.path_cost < best:
+                best = child.path_cost + other.path_cost
+                meeting = (child, other) if side == 0 else (other, child)
+    stats.peak_explored = len(reached[0]) + len(reached[1])
+    stats.seconds = time.perf_counter() - start
+    stats.peak_rss_kb = peak_rss_kb()
+    if meeting is None:
+        return None
+    forward, backward = meeting
+    actions = forward.solution() + [reverse_problem.forward_action(action)
+                                    for action in reversed(backward.solution())]
+    return actions, best
+
 #______________________________________________________________________________
 #
 
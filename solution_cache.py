@@ -0,0 +1,149 @@
+'''
+
+Persistent cache of weighted Sokoban solutions.
+
+Levels are identified by a canonical key that does not depend on the
+orientation of the level: the walls, targets, weighted boxes and worker
+cell are written out under each of the eight rotations and reflections of
+the grid, translated to the origin, and the smallest of these descriptions
+is hashed with SHA-256. The key is therefore stable across processes and
+runs, and a mirrored or rotated copy of a level shares its cache entry.
+
+Solutions are stored in the canonical orientation, in an SQLite database,
+and mapped back to the orientation of the level being solved on lookup.
+The least recently used entries are evicted beyond max_entries.
+
+'''
+
+import hashlib
+import json
+import sqlite3
+
+
+DEFAULT_PATH = 'solution_cache.sqlite'
+
+# Version of the canonical description, part of every key
+KEY_VERSION = 'sokoban-level-v1'
+
+DIRECTIONS = {'Left': (-1, 0), 'Right': (1, 0), 'Up': (0, -1), 'Down': (0, 1)}
+
+# The eight symmetries of the grid: (swap x and y, negate x, negate y)
+TRANSFORMS = [(swap, flip_x, flip_y)
+              for swap in (False, True)
+              for flip_x in (False, True)
+              for flip_y in (False, True)]
+
+
+def transform_cell(cell, transform):
+    '''Return the image of the cell (or direction vector) under transform.'''
+    x, y = cell
+    swap, flip_x, flip_y = transform
+    if swap:
+        x, y = y, x
+    return (-x if flip_x else x, -y if flip_y else y)
+
+
+def action_map(transform):
+    '''Return the dict mapping each action to its image under transform.'''
+    vectors = {vector: action for action, vector in DIRECTIONS.items()}
+    return {action: vectors[transform_cell(vector, transform)]
+            for action, vector in DIRECTIONS.items()}
+
+
+def describe_level(warehouse, transform):
+    '''
+    Return the description of the warehouse under transform, with every
+    cell translated so that the walls start at row 0 and column 0.
+    '''
+    walls = [transform_cell(cell, transform) for cell in warehouse.walls]
+    ox = min(x for x, _ in walls)
+    oy = min(y for _, y in walls)
+
+    def image(cell):
+        x, y = transform_cell(cell, transform)
+        return (x - ox, y - oy)
+
+    boxes = [image(box) + (weight,) for box, weight in zip(warehouse.boxes, warehouse.weights)]
+    return json.dumps([KEY_VERSION,
+                       sorted(image(cell) for cell in warehouse.walls),
+                       sorted(image(cell) for cell in warehouse.targets),
+                       sorted(boxes),
+                       image(warehouse.worker)])
+
+
+def canonical_key(warehouse):
+    '''
+    Return (key, transform): the hexadecimal canonical key of the warehouse
+    and the transform mapping the warehouse to its canonical orientation.
+    '''
+    description, transform = min((describe_level(warehouse, transform), transform)
+                                 for transform in TRANSFORMS)
+    return hashlib.sha256(description.encode()).hexdigest(), transform
+
+
+class SolutionCache:
+    '''
+    On-disk cache of (solution, cost) pairs keyed by canonical level key,
+    holding at most max_entries solutions. The database is opened on the
+    first access.
+    '''
+
+    def __init__(self, path=DEFAULT_PATH, max_entries=10000):
+        self.path = path
+        self.max_entries = max_entries
+        self.db = None
+
+    def connect(self):
+        '''Open the database, creating its table and index if needed.'''
+        self.db = sqlite3.connect(self.path)
+        self.db.execute('CREATE TABLE IF NOT EXISTS solutions ('
+                        'key TEXT PRIMARY KEY, solution TEXT, used INTEGER)')
+        # Keeps the use stamps and the eviction order off full table scans
+        self.db.execute('CREATE INDEX IF NOT EXISTS solutions_used ON solutions (used)')
+        self.db.commit()
+
+    def __len__(self):
+        if self.db is None:
+            self.connect()
+        return self.db.execute('SELECT COUNT(*) FROM solutions').fetchone()[0]
+
+    def _next_use(self):
+        return self.db.execute('SELECT COALESCE(MAX(used), 0) + 1 FROM solutions').fetchone()[0]
+
+    def get(self, warehouse):
+        '''
+        Return the cached (solution, cost) of the warehouse, in its own
+        orientation, or None if it is not cached.
+        '''
+        if self.db is None:
+            self.connect()
+        key, transform = canonical_key(warehouse)
+        row = self.db.execute('SELECT solution FROM solutions WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        self.db.execute('UPDATE solutions SET used = ? WHERE key = ?', (self._next_use(), key))
+        self.db.commit()
+        solution, cost = json.loads(row[0])
+        if cost is not None:
+            to_level = {image: action for action, image in action_map(transform).items()}
+            solution = [to_level[action] for action in solution]
+        return solution, cost
+
+    def put(self, warehouse, solution, cost):
+        '''
+        Store the solution and cost of the warehouse (['Impossible'] and
+        None for an unsolvable level), evicting the least recently used
+        entries beyond max_entries.
+        '''
+        if self.db is None:
+            self.connect()
+        key, transform = canonical_key(warehouse)
+        if cost is not None:
+            to_canonical = action_map(transform)
+            solution = [to_canonical[action] for action in solution]
+        self.db.execute('INSERT OR REPLACE INTO solutions VALUES (?, ?, ?)',
+                        (key, json.dumps([solution, cost]), self._next_use()))
+        self.db.execute('DELETE FROM solutions WHERE key IN ('
+                        'SELECT key FROM solutions ORDER BY used DESC LIMIT -1 OFFSET ?)',
+                        (self.max_entries,))
+        self.db.commit()
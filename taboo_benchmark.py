@@ -0,0 +1,85 @@
+'''
+
+Benchmark of the taboo cell analysis on large synthetic warehouses.
+
+Each warehouse is a square grid of the given size, walled all around,
+with interior walls placed at random with the given density, and a few
+boxes, targets and the worker on random free cells. For every warehouse,
+taboo_cells (linear in the size of the grid) is timed against
+pairwise_taboo_cells, the former implementation that checks every pair of
+aligned corners, and their maps are compared. The run fails (exit status
+1) if the two maps ever differ.
+
+Usage:
+    python taboo_benchmark.py [--size 200] [--densities 0.1 0.2 0.3]
+                              [--seeds 3] [--no-reference]
+
+'''
+
+import argparse
+import random
+import sys
+import time
+
+from sokoban import Warehouse
+from mySokobanSolver import taboo_cells, pairwise_taboo_cells
+
+
+def synthetic_warehouse(size, density, seed, boxes=20):
+    '''
+    Return a random size x size warehouse whose interior cells are walls
+    with probability density, with the given number of boxes and targets.
+    '''
+    rng = random.Random(seed)
+    grid = [['#' if x in (0, size - 1) or y in (0, size - 1) or rng.random() < density else ' '
+             for x in range(size)]
+            for y in range(size)]
+    free = [(x, y) for y in range(size) for x in range(size) if grid[y][x] == ' ']
+    cells = rng.sample(free, 2 * boxes + 1)
+    for x, y in cells[:boxes]:
+        grid[y][x] = '$'
+    for x, y in cells[boxes:2 * boxes]:
+        grid[y][x] = '.'
+    x, y = cells[-1]
+    grid[y][x] = '@'
+    warehouse = Warehouse()
+    warehouse.from_string('\n'.join(''.join(row) for row in grid))
+    return warehouse
+
+
+def timed(fn, warehouse):
+    '''Return (fn(warehouse), seconds taken).'''
+    start = time.perf_counter()
+    result = fn(warehouse)
+    return result, time.perf_counter() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the taboo cell analysis.')
+    parser.add_argument('--size', type=int, default=200)
+    parser.add_argument('--densities', type=float, nargs='+', default=[0.1, 0.2, 0.3])
+    parser.add_argument('--seeds', type=int, default=3,
+                        help='number of warehouses per density')
+    parser.add_argument('--no-reference', action='store_true',
+                        help='do not time pairwise_taboo_cells')
+    args = parser.parse_args(argv)
+
+    print(f"{'density':>8}{'seed':>6}{'taboo':>8}{'linear s':>10}{'pairwise s':>12}{'speedup':>9}")
+    mismatches = 0
+    for density in args.densities:
+        for seed in range(args.seeds):
+            warehouse = synthetic_warehouse(args.size, density, seed)
+            taboo_map, seconds = timed(taboo_cells, warehouse)
+            line = f"{density:>8}{seed:>6}{taboo_map.count('X'):>8}{seconds:>10.3f}"
+            if not args.no_reference:
+                reference, reference_seconds = timed(pairwise_taboo_cells, warehouse)
+                line += f"{reference_seconds:>12.3f}{reference_seconds / seconds:>8.1f}x"
+                if reference != taboo_map:
+                    line += "  MISMATCH"
+                    mismatches += 1
+            print(line)
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
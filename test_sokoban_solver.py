@@ -16,6 +16,7 @@ marking your code, make sure that your code runs without errors with this script
 
 
 from sokoban import Warehouse
+import search
 import pytest
 
 try:
@@ -25,6 +26,17 @@ except ModuleNotFoundError:
     from mySokobanSolver import taboo_cells, solve_weighted_sokoban, check_elem_action_seq
     print("Using submitted solver")
 
+def flood_cells(worker, walls, boxes):
+    '''Reference flood fill: the cells the worker can reach without moving any box.'''
+    reached, stack = {worker}, [worker]
+    while stack:
+        x, y = stack.pop()
+        for cell in ((x - 1, y), (x + 1, y), (x, y - 1), (x, y + 1)):
+            if cell not in walls and cell not in boxes and cell not in reached:
+                reached.add(cell)
+                stack.append(cell)
+    return reached
+
 class TestSokoban:
     def test_taboo_cells_wh_01(self):
         wh = Warehouse()
@@ -139,6 +151,155 @@ class TestSokoban:
         answer = taboo_cells(wh)
         assert answer == expected_answer
 
+    def test_indexed_priority_queue(self):
+        frontier = search.IndexedPriorityQueue(f=lambda item: item[1])
+        frontier.extend([('a', 5), ('b', 3), ('c', 4)])
+        assert ('b', 3) in frontier and len(frontier) == 3
+        assert frontier[('c', 4)] == 4
+        del frontier[('b', 3)]
+        assert ('b', 3) not in frontier and len(frontier) == 2
+        frontier.append(('a', 1))
+        assert [frontier.pop(), frontier.pop(), frontier.pop()] == [('a', 1), ('c', 4), ('a', 5)]
+        with pytest.raises(KeyError):
+            del frontier[('c', 4)]
+
+    def test_zobrist_key_incremental_update(self):
+        from mySokobanSolver import SokobanPuzzle
+        wh = Warehouse()
+        wh.load_warehouse("./warehouses/warehouse_8a.txt")
+        problem = SokobanPuzzle(wh)
+        state = problem.initial
+        for action in ['Up', 'Left', 'Up', 'Left', 'Left', 'Down', 'Left', 'Down']:
+            state = problem.result(state, action)
+        worker, boxes, key = state
+        assert key == problem.zobrist.key(worker, boxes)
+        assert hash(state) == key
+
+    def test_push_distances_wh_01(self):
+        from mySokobanSolver import get_interior_cells, get_push_distances
+        wh = Warehouse()
+        wh.load_warehouse("./warehouses/warehouse_01.txt")
+        distances = get_push_distances(get_interior_cells(wh), (2, 1))
+        # the box must go round the corner: one push left, then two up
+        assert distances[(3, 3)] == 3
+        # corner cells cannot be pushed anywhere
+        assert (1, 1) not in distances and (1, 5) not in distances
+
+    def test_min_cost_matching(self):
+        from mySokobanSolver import MinCostMatching, INF
+        big = MinCostMatching.BIG
+        matching = MinCostMatching([[4, 1, 3], [2, 0, 5], [3, 2, 2]])
+        assert matching.cost() == 5
+        updated = matching.copy()
+        updated.replace_row(1, [big, big, big])
+        assert updated.cost() == INF
+        assert matching.cost() == 5
+        updated.replace_row(1, [0, 9, 9])
+        assert updated.cost() == 3
+
+    def test_infinite_heuristic_prunes_nodes(self):
+        from mySokobanSolver import SokobanPuzzle, SokobanMacroPuzzle, INF
+        wh = Warehouse()
+        # no box can be pushed up onto the target
+        wh.from_string(
+            ' ###\n'
+            '##.####\n'
+            '# $  @#\n'
+            '#######'
+        )
+        for puzzle in (SokobanPuzzle(wh), SokobanMacroPuzzle(wh)):
+            for result in (search.budgeted_astar_search(puzzle).node,
+                           search.weighted_astar_search(puzzle)[0],
+                           search.idastar_search(puzzle),
+                           search.packed_astar_search(puzzle),
+                           next(search.arastar_search(puzzle), None)):
+                assert result is None
+            stats = search.SearchStats()
+            assert search.astar_graph_search(puzzle, stats=stats) is None
+            assert stats.expanded == 0 and stats.pruned == 1
+        assert solve_weighted_sokoban(wh) == (['Impossible'], None)
+        wh.load_warehouse( "./warehouses/warehouse_01.txt")
+        expanded = []
+        stats = search.SearchStats()
+        search.astar_graph_search(SokobanPuzzle(wh), stats=stats, on_expand=expanded.append)
+        assert stats.pruned == 1 and all(node.h < INF for node in expanded)
+
+    def test_freeze_deadlock(self):
+        from mySokobanSolver import SokobanPuzzle
+        wh = Warehouse()
+        wh.from_string(
+            '#######\n'
+            '#  .  #\n'
+            '# $$  #\n'
+            '#@  . #\n'
+            '#######'
+        )
+        problem = SokobanPuzzle(wh)
+        # a single box against the wall can still slide along it
+        assert not problem.is_freeze_deadlock((2, 2), (2, 1), {(2, 2), (3, 2)})
+        # two boxes side by side against the wall, one of them off target
+        assert problem.is_freeze_deadlock((3, 2), (3, 1), {(2, 1), (3, 2)})
+        assert len(problem.deadlock_cache) == 2
+
+    def test_deadlock_pattern_database(self, tmp_path):
+        from deadlock_patterns import PatternDatabase, build_pattern_database, encode_pattern, BOX, WALL, FLOOR
+        from mySokobanSolver import SokobanPuzzle
+        path = str(tmp_path / 'patterns.db')
+        build_pattern_database(path, width=2, height=2, max_boxes=4)
+        db = PatternDatabase(path)
+        assert encode_pattern([BOX, BOX, BOX, BOX]) in db
+        assert encode_pattern([BOX, BOX, WALL, WALL]) in db
+        assert encode_pattern([BOX, BOX, FLOOR, FLOOR]) not in db
+        assert encode_pattern([BOX, FLOOR, FLOOR, WALL]) not in db
+        wh = Warehouse()
+        wh.from_string(
+            '#######\n'
+            '# ..  #\n'
+            '# $$  #\n'
+            '#@    #\n'
+            '#######'
+        )
+        problem = SokobanPuzzle(wh, pattern_db=path)
+        assert not problem.is_pattern_deadlock((3, 2), (3, 3), {(2, 2), (3, 2)})
+        # two boxes side by side against the bottom wall, off target
+        assert problem.is_pattern_deadlock((2, 2), (2, 3), {(2, 2), (3, 3)})
+        answer, cost = solve_weighted_sokoban(wh, mode='push', pattern_db=db)
+        assert cost == 5
+
+    def test_tunnel_and_goal_room_macros(self):
+        from mySokobanSolver import SokobanMacroPuzzle, get_interior_cells, get_tunnel_cells
+        wh = Warehouse()
+        wh.from_string(
+            '3\n'
+            '##########\n'
+            '#@$     .#\n'
+            '##########'
+        )
+        tunnels = get_tunnel_cells(set(wh.walls), get_interior_cells(wh))
+        assert (5, 1) in tunnels['Right'] and (5, 1) not in tunnels['Up']
+        problem = SokobanMacroPuzzle(wh, macros=True)
+        # the box is pushed down the whole corridor in a single action
+        action, = problem.actions(problem.initial)
+        state = problem.result(problem.initial, action)
+        assert state[:2] == ((7, 1), ((8, 1, 3),))
+        assert problem.path_cost(0, problem.initial, action, state) == 6 * (1 + 3)
+        assert problem.expand_actions([action]) == ['Right'] * 6
+        wh.from_string(
+            '1 5\n'
+            '#########\n'
+            '#   #   #\n'
+            '# $ #.  #\n'
+            '#@$   . #\n'
+            '#   #   #\n'
+            '#########'
+        )
+        room, = SokobanMacroPuzzle(wh, macros=True).goal_rooms
+        assert (room.entrance, room.door, room.direction) == ((4, 3), (3, 3), 'Right')
+        assert room.order == [(5, 2), (6, 3)]
+        answer, cost = solve_weighted_sokoban(wh, mode='push', macros=True)
+        assert cost == solve_weighted_sokoban(wh, mode='push')[1] == 59
+        assert '$' not in check_elem_action_seq(wh, answer)
+
     def test_check_elem_action_seq_wh_1(self):
         wh = Warehouse()
         wh.load_warehouse("./warehouses/warehouse_01.txt")
@@ -304,3 +465,348 @@ class TestSokoban:
         answer, cost = solve_weighted_sokoban(wh)
 
         print(f'\nPath:{answer}\n Cost: {cost}')
+
+    def test_solve_weighted_sokoban_push_mode_wh147(self):
+        wh = Warehouse()
+        wh.load_warehouse( "./warehouses/warehouse_147.txt")
+        answer, cost = solve_weighted_sokoban(wh, mode='push')
+        assert cost == 521
+        final_state = check_elem_action_seq(wh, answer)
+        assert final_state != 'Impossible' and '$' not in final_state
+
+    def test_solve_weighted_sokoban_bitboard_mode_wh8a(self):
+        wh = Warehouse()
+        wh.load_warehouse( "./warehouses/warehouse_8a.txt")
+        answer, cost = solve_weighted_sokoban(wh, mode='bitboard')
+        assert cost == 431
+        final_state = check_elem_action_seq(wh, answer)
+        assert final_state != 'Impossible' and '$' not in final_state
+
+    def test_solve_weighted_sokoban_corral_pruning(self):
+        wh = Warehouse()
+        wh.load_warehouse( "./warehouses/warehouse_5n.txt")
+        answer, cost = solve_weighted_sokoban(wh, mode='push', corral_pruning=True)
+        assert answer == ['Impossible'] and cost is None
+        wh.load_warehouse( "./warehouses/warehouse_03.txt")
+        answer, cost = solve_weighted_sokoban(wh, mode='push', corral_pruning='deadlock')
+        assert cost == 41
+
+    def test_idastar_search_wh01(self):
+        from mySokobanSolver import SokobanMacroPuzzle
+        wh = Warehouse()
+        wh.load_warehouse( "./warehouses/warehouse_01.txt")
+        # a tiny table forces collisions between states
+        for table_size in (2**20, 16):
+            problem = SokobanMacroPuzzle(wh)
+            node = search.idastar_search(problem, table_size=table_size)
+            assert node.path_cost == 33
+            final_state = check_elem_action_seq(wh, problem.expand_actions(node.solution()))
+            assert '$' not in final_state
+        wh.load_warehouse( "./warehouses/warehouse_03_impossible.txt")
+        assert search.idastar_search(SokobanMacroPuzzle(wh)) is None
+
+    def test_packed_astar_search(self):
+        from mySokobanSolver import SokobanPuzzle, SokobanMacroPuzzle
+        store = search.StateStore(2, capacity=2)
+        assert [store.add(bytes([i, 7])) for i in range(5)] == [(i, True) for i in range(5)]
+        assert store.add(bytes([3, 7])) == (3, False)
+        assert store.find(bytes([4, 7])) == 4 and store.find(bytes([5, 7])) == -1
+        assert bytes([4, 7]) in store and bytes([5, 7]) not in store
+        assert len(store) == 5 and store[2] == bytes([2, 7])
+        wh = Warehouse()
+        wh.load_warehouse("./warehouses/warehouse_8a.txt")
+        problem = SokobanMacroPuzzle(wh)
+        state = problem.result(problem.initial, problem.actions(problem.initial)[0])
+        assert len(problem.pack(state)) == problem.record_size
+        assert problem.unpack(problem.pack(state)) == state
+        assert hash(problem.unpack(problem.pack(state))) == hash(state)
+        node = search.packed_astar_search(problem, capacity=16)
+        assert node.path_cost == 431
+        final_state = check_elem_action_seq(wh, problem.expand_actions(node.solution()))
+        assert '$' not in final_state
+        wh.load_warehouse("./warehouses/warehouse_01.txt")
+        node = search.packed_astar_search(SokobanPuzzle(wh))
+        assert node.path_cost == 33
+        assert '$' not in check_elem_action_seq(wh, node.solution())
+        wh.load_warehouse("./warehouses/warehouse_03_impossible.txt")
+        assert search.packed_astar_search(SokobanMacroPuzzle(wh)) is None
+
+    def test_bounded_matching_cache(self):
+        from mySokobanSolver import SokobanMacroPuzzle
+        wh = Warehouse()
+        wh.load_warehouse("./warehouses/warehouse_8a.txt")
+        results = []
+        for size in (100000, 2):
+            problem = SokobanMacroPuzzle(wh)
+            problem.matching_cache_size = size
+            stats = search.SearchStats()
+            node = search.astar_graph_search(problem, stats=stats)
+            assert len(problem.matching_cache) <= size
+            results.append((node.path_cost, stats.expanded, stats.generated))
+        assert results[0] == results[1] and results[0][0] == 431
+        stats = search.SearchStats()
+        node = search.astar_graph_search(SokobanMacroPuzzle(wh), stats=stats, closed='packed')
+        assert (node.path_cost, stats.expanded, stats.generated) == results[0]
+        with pytest.raises(ValueError):
+            search.astar_graph_search(SokobanMacroPuzzle(wh), closed='list')
+
+    def test_solve_weighted_sokoban_bidirectional_mode(self):
+        wh = Warehouse()
+        wh.load_warehouse( "./warehouses/warehouse_01.txt")
+        answer, cost = solve_weighted_sokoban(wh, mode='bidirectional')
+        assert cost == 33
+        final_state = check_elem_action_seq(wh, answer)
+        assert final_state != 'Impossible' and '$' not in final_state
+        wh.load_warehouse( "./warehouses/warehouse_03_impossible.txt")
+        answer, cost = solve_weighted_sokoban(wh, mode='bidirectional')
+        assert answer == ['Impossible'] and cost is None
+        from mySokobanSolver import SokobanPullPuzzle
+        wh.load_warehouse( "./warehouses/warehouse_01.txt")
+        for worker, boxes, _ in SokobanPullPuzzle(wh).initials:
+            assert any(abs(worker[0] - x) + abs(worker[1] - y) == 1 for x, y, _ in boxes)
+        wh.from_string("#####\n#@ *#\n#####")
+        assert solve_weighted_sokoban(wh, mode='bidirectional') == ([], 0)
+
+    def test_batch_solver_solve_level(self):
+        from batch_solver import level_paths, level_size, solve_level
+        paths = level_paths(["./warehouses/warehouse_0*.txt", "./warehouses/warehouse_01.txt"])
+        assert paths.count("./warehouses/warehouse_01.txt") == 1
+        assert level_size("./warehouses/warehouse_147.txt") > level_size("./warehouses/warehouse_01.txt")
+        record = solve_level("./warehouses/warehouse_01.txt", mode='push')
+        assert record['status'] == 'solved' and record['cost'] == 33
+        assert record['nodes'] == 23 and record['generated'] == 44 and record['peak_rss_kb'] > 0
+        record = solve_level("./warehouses/warehouse_01.txt", mode='bidirectional')
+        assert record['cost'] == 33 and record['nodes'] > 0
+        # the weights line does not match the boxes: sized, then reported as an error
+        assert level_size("./warehouses/warehouse_101.txt") == (5, 56)
+        record = solve_level("./warehouses/warehouse_101.txt")
+        assert record['status'] == 'error' and record['error'].startswith('AssertionError')
+
+    def test_solve_weighted_sokoban_portfolio_mode(self, caplog):
+        from mySokobanSolver import run_strategy
+        wh = Warehouse()
+        wh.load_warehouse( "./warehouses/warehouse_8a.txt")
+        # weighted A* finds a cheap but suboptimal solution it cannot prove
+        answer, cost, proven = run_strategy(wh, mode='push', algorithm='weighted', weight=5)
+        assert cost == 439 and not proven
+        answer, cost = solve_weighted_sokoban(wh, mode='portfolio')
+        assert cost == 431
+        final_state = check_elem_action_seq(wh, answer)
+        assert final_state != 'Impossible' and '$' not in final_state
+        # corral pruning may lose the optimum, its result must not win the race
+        wh.load_warehouse( "./warehouses/warehouse_63.txt")
+        answer, cost, proven = run_strategy(wh, mode='push', corral_pruning=True)
+        assert cost == 111 and not proven
+        strategies = ({'mode': 'push', 'corral_pruning': True}, {'mode': 'push'})
+        answer, cost = solve_weighted_sokoban(wh, mode='portfolio', strategies=strategies)
+        assert cost == 101
+        # a crashing strategy is logged, and only fails the race on its own
+        strategies = ({'mode': 'push', 'algorithm': 'broken'}, {'mode': 'push'})
+        answer, cost = solve_weighted_sokoban(wh, mode='portfolio', strategies=strategies)
+        assert cost == 101
+        with caplog.at_level('WARNING', logger='mySokobanSolver'):
+            with pytest.raises(RuntimeError, match="Unknown search algorithm"):
+                solve_weighted_sokoban(wh, mode='portfolio', strategies=strategies[:1])
+        assert 'ValueError' in caplog.text
+
+    def test_solve_within_budget(self):
+        from mySokobanSolver import solve_within_budget
+        wh = Warehouse()
+        wh.load_warehouse( "./warehouses/warehouse_8a.txt")
+        result = solve_within_budget(wh, search.SearchBudget(max_nodes=140))
+        # out of budget, but a suboptimal solution was already generated
+        assert result.status == search.SearchResult.EXHAUSTED
+        assert result.cost == 436 and result.stats.expanded == 140 and not result.optimal
+        assert '$' not in check_elem_action_seq(wh, result.solution)
+        result = solve_within_budget(wh, search.SearchBudget(max_seconds=60))
+        assert result.status == search.SearchResult.SOLVED and result.cost == 431
+        assert result.optimal
+        # the cost of a normalised solve counts the walks, and is not optimal
+        wh.load_warehouse( "./warehouses/warehouse_03.txt")
+        result = solve_within_budget(wh, search.SearchBudget(max_seconds=60), normalize=True)
+        assert result.cost == 41 and not result.optimal
+        wh.load_warehouse( "./warehouses/warehouse_5n.txt")
+        result = solve_within_budget(wh, search.SearchBudget(max_nodes=10**6))
+        assert result.status == search.SearchResult.IMPOSSIBLE and result.solution is None
+
+    def test_arastar_search_wh47(self):
+        from mySokobanSolver import SokobanMacroPuzzle
+        wh = Warehouse()
+        wh.load_warehouse( "./warehouses/warehouse_47.txt")
+        solutions = list(search.arastar_search(SokobanMacroPuzzle(wh), epsilon=3))
+        costs = [node.path_cost for node, bound in solutions]
+        assert costs == sorted(costs, reverse=True) and costs[-1] == 179
+        assert all(bound <= 3 for node, bound in solutions) and solutions[-1][1] == 1
+        answer, cost = solve_weighted_sokoban(wh, mode='push', algorithm='arastar', weight=3, bound=1.2)
+        assert 179 <= cost <= 1.2 * 179
+        assert '$' not in check_elem_action_seq(wh, answer)
+
+    def test_solution_cache_symmetries(self, tmp_path):
+        from solution_cache import SolutionCache, canonical_key
+        wh = Warehouse()
+        wh.load_warehouse( "./warehouses/warehouse_47.txt")
+        width = max(x for x, y in wh.walls)
+        mirrored = wh.copy(worker=(width - wh.worker[0], wh.worker[1]),
+                           boxes=[(width - x, y) for x, y in wh.boxes])
+        mirrored.walls = [(width - x, y) for x, y in wh.walls]
+        mirrored.targets = [(width - x, y) for x, y in wh.targets]
+        assert canonical_key(mirrored)[0] == canonical_key(wh)[0]
+        cache = SolutionCache(str(tmp_path / 'cache.sqlite'), max_entries=1)
+        assert cache.get(mirrored) is None
+        answer, cost = solve_weighted_sokoban(wh, mode='push', cache=cache)
+        answer, cached_cost = cache.get(mirrored)
+        assert cached_cost == cost == 179
+        assert '$' not in check_elem_action_seq(mirrored, answer)
+        # the least recently used level is evicted
+        wh.load_warehouse( "./warehouses/warehouse_01.txt")
+        solve_weighted_sokoban(wh, mode='push', cache=cache)
+        assert len(cache) == 1 and cache.get(mirrored) is None
+
+    def test_solution_cache_skips_unproven_solutions(self, tmp_path):
+        from solution_cache import SolutionCache
+        wh = Warehouse()
+        wh.load_warehouse( "./warehouses/warehouse_157.txt")
+        cache = SolutionCache(str(tmp_path / 'cache.sqlite'))
+        answer, cost = solve_weighted_sokoban(wh, mode='push', corral_pruning=True, cache=cache)
+        assert cost == 59 and len(cache) == 0
+        answer, cost = solve_weighted_sokoban(wh, mode='push', cache=cache)
+        assert cost == 55 and cache.get(wh)[1] == 55
+
+    def test_benchmark_compare(self):
+        from benchmark_suite import compare, measurements
+        base = {'status': 'solved', 'cost': 33, 'time': 1.0, 'relative_time': 10.0, 'nodes': 100}
+        baseline = {'a.txt': base, 'b.txt': base, 'c.txt': base, 'd.txt': base}
+        report = {
+            'a.txt': dict(base, time=1.1, relative_time=11.0, nodes=104),  # within thresholds
+            'b.txt': dict(base, nodes=120),
+            'c.txt': dict(base, time=2.0, relative_time=20.0),
+            'd.txt': dict(base, cost=35),
+            'e.txt': dict(base),  # not in the baseline
+        }
+        # timings are not gated unless asked for
+        regressions = compare(report, baseline)
+        assert [r.split(':')[0] for r in regressions] == ['b.txt', 'd.txt']
+        regressions = compare(report, baseline, time_threshold=0.25)
+        assert [r.split(':')[0] for r in regressions] == ['b.txt', 'c.txt', 'd.txt']
+        # a slower machine: absolute times grow, relative times do not
+        report['c.txt'] = dict(base, time=2.0)
+        assert len(compare(report, baseline, time_threshold=0.25)) == 2
+        records = [dict(base, generated=150, peak_rss_kb=10, time=t) for t in (1.0, 3.0, 1.2)]
+        run = measurements(records, calibration=0.1)
+        assert run['time'] == 1.2 and run['relative_time'] == 12.0
+
+    def test_search_stats(self):
+        from mySokobanSolver import SokobanMacroPuzzle
+        wh = Warehouse()
+        wh.load_warehouse( "./warehouses/warehouse_01.txt")
+        answer, cost, stats = solve_weighted_sokoban(wh, mode='push', return_stats=True)
+        assert cost == 33 and stats.expanded == 23
+        assert 0 < stats.duplicates < stats.generated and stats.peak_frontier > 0
+        assert set(stats.timings) == {'actions', 'result', 'path_cost', 'goal_test', 'h'}
+        expanded = []
+        stats = search.SearchStats()
+        node = search.astar_graph_search(SokobanMacroPuzzle(wh), stats=stats,
+                                         on_expand=expanded.append)
+        assert node.path_cost == 33 and len(expanded) == stats.expanded == 23
+        assert stats.timings == {} and stats.peak_explored == 23
+
+    def test_taboo_cells_matches_pairwise_scan(self):
+        from mySokobanSolver import pairwise_taboo_cells
+        from taboo_benchmark import synthetic_warehouse
+        for seed in range(10):
+            wh = synthetic_warehouse(30, 0.1 + 0.02 * seed, seed, boxes=5)
+            assert taboo_cells(wh) == pairwise_taboo_cells(wh)
+        # A corridor winding through the whole warehouse is too long for the
+        # bit-parallel flood fill, which leaves the interior to fill_runs
+        rows = ['#' * 41]
+        for y in range(1, 40):
+            if y % 2:
+                rows.append('#' + ' ' * 39 + '#')
+            else:
+                rows.append('#' * 39 + ' #' if y % 4 == 2 else '# ' + '#' * 39)
+        rows.append('#' * 41)
+        rows[1] = '#@$.' + ' ' * 36 + '#'
+        wh = Warehouse()
+        wh.from_string('\n'.join(rows))
+        assert taboo_cells(wh) == pairwise_taboo_cells(wh)
+
+    def test_level_analysis_cache(self, tmp_path):
+        import os
+        import mySokobanSolver
+        from mySokobanSolver import SokobanPuzzle, SokobanMacroPuzzle, get_level_analysis
+        wh = Warehouse()
+        wh.load_warehouse( "./warehouses/warehouse_01.txt")
+        # same walls and targets, other boxes: the analysis is shared
+        solved = wh.copy(boxes=list(wh.targets))
+        analysis = SokobanPuzzle(wh).analysis
+        assert SokobanMacroPuzzle(solved, macros=True).analysis is analysis
+        mySokobanSolver._level_analyses.clear()
+        get_level_analysis(wh, str(tmp_path))
+        assert os.listdir(tmp_path) == [analysis.key + '.pickle']
+        mySokobanSolver._level_analyses.clear()
+        loaded = get_level_analysis(wh, str(tmp_path))
+        assert loaded is not analysis and loaded.taboo_set == analysis.taboo_set
+        assert loaded.push_distance == analysis.push_distance
+        answer, cost = solve_weighted_sokoban(wh, mode='push', analysis_dir=str(tmp_path))
+        assert cost == 33
+
+    def test_solve_weighted_sokoban_normalized_workers(self):
+        from mySokobanSolver import SokobanMacroPuzzle, get_elem_action_cost
+        wh = Warehouse()
+        wh.load_warehouse( "./warehouses/warehouse_03.txt")
+        problem = SokobanMacroPuzzle(wh, normalize=True)
+        stats = search.SearchStats()
+        node = search.astar_graph_search(problem, stats=stats)
+        assert stats.expanded == 30  # 86 without normalization
+        answer, cost = solve_weighted_sokoban(wh, mode='push', normalize=True)
+        assert answer == problem.expand_actions(node.solution())
+        assert cost == get_elem_action_cost(wh, answer) == 41
+        assert '$' not in check_elem_action_seq(wh, answer)
+
+    def test_reachability_cache(self):
+        from mySokobanSolver import SokobanMacroPuzzle, get_walk_path, get_walk_steps
+        wh = Warehouse()
+        wh.load_warehouse( "./warehouses/warehouse_03.txt")
+        problem = SokobanMacroPuzzle(wh, normalize=True)
+        cache = problem.reachability
+        boxes_xy = set(wh.boxes)
+        region = cache.region(wh.worker, boxes_xy)
+        assert set(problem.analysis.mask_cells(region)) == \
+            flood_cells(wh.worker, problem.walls, boxes_xy)
+        assert cache.region(problem.initial[0], boxes_xy) is region
+        assert (cache.hits, cache.misses) == (2, 1)  # the first lookup was in __init__
+        search.astar_graph_search(problem)
+        assert cache.incremental > cache.misses and 0 < cache.hit_rate() < 1
+        # without normalize, the walks are measured inside the cached regions
+        problem = SokobanMacroPuzzle(wh)
+        assert search.astar_graph_search(problem).path_cost == 41
+        assert problem.reachability.misses > 0 and problem.reachability.hits > 0
+        analysis = problem.analysis
+        region = problem.reachability.region(wh.worker, boxes_xy)
+        far = max(analysis.mask_cells(region),
+                  key=lambda c: abs(c[0] - wh.worker[0]) + abs(c[1] - wh.worker[1]))
+        steps = get_walk_steps(1 << analysis.bit(wh.worker),
+                               analysis.to_mask([wh.worker, far]), region, analysis.stride)
+        assert steps == {analysis.bit(wh.worker): 0,
+                         analysis.bit(far): len(get_walk_path(wh.worker, far, problem.walls,
+                                                              boxes_xy))}
+
+    def test_reachable_mask_matches_flood_fill(self):
+        from itertools import combinations
+        from mySokobanSolver import get_level_analysis, get_reachable_mask
+        for name in ("01", "03", "47"):
+            wh = Warehouse()
+            wh.load_warehouse("./warehouses/warehouse_{}.txt".format(name))
+            analysis = get_level_analysis(wh)
+            walls = set(wh.walls)
+            stride = wh.ncols + 1  # the row-major numbering of SokobanBitboardPuzzle
+            for k in range(3):
+                for boxes in combinations(wh.boxes, k):
+                    free = sum(1 << y * stride + x for x, y in analysis.cells if (x, y) not in boxes)
+                    for worker in sorted(analysis.open_cells - set(boxes)):
+                        expected = flood_cells(worker, walls, set(boxes))
+                        mask = analysis.reachable_mask(worker, analysis.to_mask(boxes))
+                        assert set(analysis.mask_cells(mask)) == expected
+                        mask = get_reachable_mask(1 << worker[1] * stride + worker[0], free, stride)
+                        assert {(b % stride, b // stride) for b in range(mask.bit_length())
+                                if mask >> b & 1} == expected